@@ -0,0 +1,90 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    # Token buckets per (client, route class). rates: {route class: (tokens
+    # per second, burst)}; classes without an entry are not limited. At most
+    # max_clients buckets are kept, the least recently seen are dropped (a
+    # dropped client simply starts again with a full bucket).
+    def __init__(self, rates, max_clients=10000):
+        self.rates = rates
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client, route_class):
+        # Returns 0 when the request may proceed, otherwise the seconds until
+        # the bucket has a token again
+        rate = self.rates.get(route_class)
+        if rate is None:
+            return 0
+        per_second, burst = rate
+        key = (client, route_class)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(burst), now]
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * per_second)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / per_second
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyGate:
+    # At most `limit` holders at once. Up to `queue_size` more wait, each for
+    # at most `timeout` seconds; anyone beyond that is turned away at once.
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+
+    def enter(self):
+        with self._cond:
+            if self._active < self.limit and not self._waiting:
+                self._active += 1
+                return
+            if self._waiting >= self.queue_size:
+                raise Overloaded("queue full")
+            self._waiting += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self._active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Overloaded("timed out waiting")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._active += 1
+
+    def exit(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {'limit': self.limit, 'active': self._active, 'waiting': self._waiting,
+                    'queue_size': self.queue_size}
+
+
+def retry_after(seconds):
+    # Retry-After takes whole seconds
+    return str(max(1, int(math.ceil(seconds))))
@@ -0,0 +1,144 @@
+# ASGI entry point: the detail endpoints run as async handlers on an aiomysql
+# pool, everything else is served by the Flask app from server.py.
+#
+#   gunicorn -c gunicorn.conf.py asgi:app
+#
+# The async routes bypass Flask's request hooks. async_route() gives them the
+# same CORS origins, request metrics and rate limit ('cheap' class). They
+# always read from the primary, MYSQL_REPLICAS applies to Flask routes only.
+import asyncio
+import time
+
+import aiomysql
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+import metrics
+import queries
+import server
+from admission import retry_after
+
+config = server.app.config
+pool = None
+
+
+async def startup():
+    global pool
+    # max_execution_time makes MySQL abort SELECTs that outlive the client-side timeout
+    pool = await aiomysql.create_pool(host=config['MYSQL_HOST'],
+                                      port=config['MYSQL_PORT'],
+                                      user=config['MYSQL_USER'],
+                                      password=config['MYSQL_PASSWORD'],
+                                      db=config['MYSQL_DB'],
+                                      minsize=1,
+                                      maxsize=config['ASYNC_POOL_SIZE'],
+                                      pool_recycle=config['MYSQL_POOL_MAX_LIFETIME'],
+                                      autocommit=True,
+                                      init_command="SET SESSION max_execution_time = %d"
+                                                   % (config['QUERY_TIMEOUT'] * 1000),
+                                      cursorclass=aiomysql.DictCursor)
+    # Warm the in-memory indexes before taking traffic, as python server.py does
+    server.availability.ensure_loaded()
+    server.geo_cache.ensure_loaded()
+    server.film_search.ensure_loaded()
+    # Each worker process also picks up queued jobs, including ones a dead worker left behind
+    server.job_queue.ensure_started()
+    if config['QUERY_SELF_CHECK']:
+        # Fills the plans /queries shows and logs full scans, as python server.py does
+        server.check_queries()
+
+
+async def shutdown():
+    pool.close()
+    await pool.wait_closed()
+
+
+async def fetchall(query, *args, timeout=None):
+    timeout = timeout or config['QUERY_TIMEOUT']
+    conn = await pool.acquire()
+    try:
+        async with conn.cursor() as cursor:
+            await asyncio.wait_for(cursor.execute(query.sql, query.bind(args)), timeout)
+            return await cursor.fetchall()
+    except asyncio.TimeoutError:
+        # The connection is mid-query, don't hand it to anyone else
+        conn.close()
+        raise
+    finally:
+        pool.release(conn)
+
+
+def json_response(data, status_code=200):
+    # Same encoder as the Flask routes so dates and decimals look identical
+    return Response(server.app.json.dumps(data), status_code=status_code, media_type='application/json')
+
+
+def async_route(path, handler):
+    # What server.py's before/after_request hooks do for Flask routes
+    async def endpoint(request):
+        if request.method == 'OPTIONS':
+            return Response(headers={'Allow': 'OPTIONS, POST'})
+        start = time.perf_counter()
+        wait = 0
+        if config['ADMISSION_ENABLED']:
+            wait = server.rate_limiter.take(request.client.host if request.client else 'unknown', 'cheap')
+        if wait:
+            metrics.admission_rejections.inc(1, 'cheap', 'rate_limited')
+            response = json_response({'message': 'Rate limit exceeded'}, 429)
+            response.headers['Retry-After'] = retry_after(wait)
+        else:
+            try:
+                response = await handler(request)
+            except asyncio.TimeoutError:
+                response = json_response({'message': 'Query timed out'}, 504)
+        metrics.request_latency.observe(time.perf_counter() - start, request.method, path, response.status_code)
+        metrics.response_size.observe(len(response.body), request.method, path)
+        return response
+
+    # OPTIONS is routed here so CORSMiddleware can answer the preflight
+    cors = Middleware(CORSMiddleware, allow_origins=cors_origins(), allow_methods=['POST'], allow_headers=['*'],
+                      allow_credentials=config['CORS_SUPPORTS_CREDENTIALS'])
+    return Route(path, endpoint, methods=['POST', 'OPTIONS'], middleware=[cors])
+
+
+def cors_origins():
+    origins = config['CORS_ORIGINS']
+    return [origins] if isinstance(origins, str) else list(origins)
+
+
+async def film_details(request):
+    data = await request.json()
+    return json_response(await fetchall(queries.FILM_DETAILS, data['film_id']))
+
+
+async def actor_details(request):
+    data = await request.json()
+    actor_id = data['actor_id']
+    return json_response(await fetchall(queries.ACTOR_DETAILS, actor_id, actor_id))
+
+
+async def films_data(request):
+    data = await request.json()
+    return json_response(await fetchall(queries.FILM_DATA, data['film_id']))
+
+
+async def customers_data(request):
+    data = await request.json()
+    return json_response(await fetchall(queries.CUSTOMER_DATA, data['customer_id']))
+
+
+app = Starlette(
+    routes=[
+        async_route('/details/top5films', film_details),
+        async_route('/details/top5actors', actor_details),
+        async_route('/details/filmdata', films_data),
+        async_route('/details/customerdata', customers_data),
+        Mount('/', WSGIMiddleware(server.app)),
+    ],
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+
+import queries
+
+log = logging.getLogger('sakila.availability')
+
+
+class AvailabilityIndex:
+    # In-memory view of which inventory units are on the shelf, per film.
+    # Built from one bulk query, kept current by the rent/return handlers and
+    # periodically reconciled against MySQL to correct any drift.
+    def __init__(self, connect, reconcile_interval=300):
+        self._connect = connect
+        self.reconcile_interval = reconcile_interval
+        self._lock = threading.Lock()
+        # Serialises the first load, so concurrent cold requests wait for one
+        self._load_lock = threading.Lock()
+        self._free = {}
+        self._film_of = {}
+        self._loaded = False
+        self._rebuilding = False
+        self._pending = []
+        self._thread = None
+        self.last_reconcile = None
+
+    def _load(self):
+        db = self._connect()
+        cursor = db.cursor()
+        try:
+            queries.INVENTORY_STATUS.run(cursor)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+            db.close()
+
+        free = {}
+        film_of = {}
+        for row in rows:
+            film_of[row['inventory_id']] = row['film_id']
+            units = free.setdefault(row['film_id'], set())
+            if not row['rented']:
+                units.add(row['inventory_id'])
+        return free, film_of
+
+    def reconcile(self):
+        with self._lock:
+            self._rebuilding = True
+            self._pending = []
+        try:
+            free, film_of = self._load()
+        except Exception:
+            with self._lock:
+                self._rebuilding = False
+            raise
+        with self._lock:
+            # Replay rentals/returns that happened while the snapshot was loading
+            for op, film_id, inventory_id in self._pending:
+                units = free.setdefault(film_id, set())
+                if op == 'rented':
+                    units.discard(inventory_id)
+                else:
+                    units.add(inventory_id)
+                film_of.setdefault(inventory_id, film_id)
+            self._free = free
+            self._film_of = film_of
+            self._loaded = True
+            self._rebuilding = False
+            self._pending = []
+            self.last_reconcile = time.time()
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            self.reconcile()
+            if self.reconcile_interval and self._thread is None:
+                self._thread = threading.Thread(target=self._reconcile_loop, daemon=True)
+                self._thread.start()
+
+    def _reconcile_loop(self):
+        while True:
+            time.sleep(self.reconcile_interval)
+            try:
+                self.reconcile()
+            except Exception:
+                log.exception("availability reconcile failed")
+
+    def available(self, film_id):
+        self.ensure_loaded()
+        with self._lock:
+            return len(self._free.get(film_id, ()))
+
+    def available_many(self, film_ids):
+        self.ensure_loaded()
+        with self._lock:
+            return {film_id: len(self._free.get(film_id, ())) for film_id in film_ids}
+
+    def mark_rented(self, inventory_id):
+        with self._lock:
+            film_id = self._film_of.get(inventory_id)
+            if film_id is None:
+                return
+            self._free.get(film_id, set()).discard(inventory_id)
+            if self._rebuilding:
+                self._pending.append(('rented', film_id, inventory_id))
+
+    def release(self, inventory_id, film_id=None):
+        with self._lock:
+            if film_id is None:
+                film_id = self._film_of.get(inventory_id)
+                if film_id is None:
+                    return
+            self._film_of.setdefault(inventory_id, film_id)
+            self._free.setdefault(film_id, set()).add(inventory_id)
+            if self._rebuilding:
+                self._pending.append(('release', film_id, inventory_id))
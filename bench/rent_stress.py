@@ -0,0 +1,138 @@
+# Concurrency stress check for /rentFilm.
+#
+#   python bench/rent_stress.py --url http://localhost:8080 --concurrency 200 --rounds 5
+#
+# Each round returns every open rental of one film, then fires --concurrency
+# simultaneous rentals of that film. A round passes when exactly as many
+# requests succeed as the film has copies, the rest get 409, every rental_id
+# is distinct, and MySQL shows no copy with more than one open rental.
+# Exits non-zero on the first failed round. The resets bypass the summary
+# tables, run `flask --app server rebuild-stats` afterwards. All requests come
+# from one client, so set ADMISSION_ENABLED = False (or raise the 'write'
+# rate limit) on the server first.
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+import pymysql
+
+CUSTOMERS = 599
+
+
+def rent(url, film_id, barrier, results, lock):
+    target = urlparse(url)
+    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+    body = json.dumps({'customer_id': random.randint(1, CUSTOMERS), 'film_id': film_id})
+    barrier.wait()
+    start = time.perf_counter()
+    try:
+        conn.request('POST', '/rentFilm', body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        payload = response.read()
+        outcome = (response.status, json.loads(payload) if response.status == 200 else None)
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        outcome = ('error: %s' % e, None)
+    finally:
+        conn.close()
+    with lock:
+        results.append((outcome, time.perf_counter() - start))
+
+
+def reset_film(db, film_id):
+    # Returns the film's open rentals so every copy is on the shelf
+    cursor = db.cursor()
+    cursor.execute("""UPDATE sakila.rental r
+        JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
+        SET r.return_date = NOW()
+        WHERE i.film_id = %s AND r.return_date IS NULL""", (film_id,))
+    cursor.execute("SELECT COUNT(*) AS n FROM sakila.inventory WHERE film_id = %s", (film_id,))
+    copies = cursor.fetchone()['n']
+    db.commit()
+    cursor.close()
+    return copies
+
+
+def double_rented(db, film_id):
+    cursor = db.cursor()
+    cursor.execute("""SELECT r.inventory_id, COUNT(*) AS n
+        FROM sakila.rental r
+        JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
+        WHERE i.film_id = %s AND r.return_date IS NULL
+        GROUP BY r.inventory_id
+        HAVING COUNT(*) > 1""", (film_id,))
+    rows = cursor.fetchall()
+    db.commit()
+    cursor.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent /rentFilm stress check")
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--film-id', type=int, help='defaults to the film with the most copies')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='password')
+    args = parser.parse_args()
+
+    db = pymysql.connect(host=args.host, port=args.port, user=args.user, password=args.password,
+                         db='sakila', cursorclass=pymysql.cursors.DictCursor)
+    film_id = args.film_id
+    if film_id is None:
+        cursor = db.cursor()
+        cursor.execute("SELECT film_id FROM sakila.inventory GROUP BY film_id ORDER BY COUNT(*) DESC LIMIT 1")
+        film_id = cursor.fetchone()['film_id']
+        cursor.close()
+
+    failed = False
+    for round_number in range(1, args.rounds + 1):
+        copies = reset_film(db, film_id)
+        results = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(args.concurrency)
+        threads = [threading.Thread(target=rent, args=(args.url, film_id, barrier, results, lock))
+                   for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        rented = [payload['rental_id'] for (status, payload), _ in results if status == 200]
+        out_of_stock = sum(1 for (status, _), _ in results if status == 409)
+        errors = [status for (status, _), _ in results if status not in (200, 409)]
+        doubles = double_rented(db, film_id)
+        slowest = max(elapsed for _, elapsed in results) * 1000
+
+        problems = []
+        if len(rented) != copies:
+            problems.append('%d rented, film has %d copies' % (len(rented), copies))
+        if len(set(rented)) != len(rented):
+            problems.append('duplicate rental_id in responses')
+        if errors:
+            problems.append('%d errors, e.g. %s' % (len(errors), errors[0]))
+        if doubles:
+            problems.append('copies with several open rentals: %s' % [row['inventory_id'] for row in doubles])
+
+        print("round %d film %d: %d rented, %d out of stock, %d errors, slowest %.0f ms%s"
+              % (round_number, film_id, len(rented), out_of_stock, len(errors), slowest,
+                 '' if not problems else '  FAILED: ' + '; '.join(problems)))
+        if problems:
+            failed = True
+            break
+
+    db.close()
+    if not failed:
+        print("all %d rounds passed" % args.rounds)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
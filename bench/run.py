@@ -0,0 +1,239 @@
+# Load test for every route in server.py.
+#
+#   python bench/run.py --url http://localhost:8080 --concurrency 16 --duration 20
+#   python bench/run.py --mix top_films=5,films=3,film_data=2,rent=1 --out bench/results.json
+#   python bench/run.py --baseline bench/before.json --out bench/after.json
+#   python bench/run.py --rows-examined --db-password password
+#
+# Each scenario runs on its own for --duration seconds so the DB queries per
+# request (read from the /metrics statement counters) belong to that route.
+# --mix adds a final "mixed" phase with the given weights. Results are written
+# as JSON so runs from different commits can be diffed.
+#
+# --rows-examined also reads MySQL's performance_schema statement digests and
+# reports rows examined per request, which is what an index change moves:
+# seed with --skip-migrations, run with --out before.json, apply the
+# migrations (flask --app server migrate) and run again with --baseline.
+import argparse
+import http.client
+import json
+import random
+import subprocess
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+CUSTOMERS = 599
+FILMS = 1000
+ACTORS = 200
+
+
+def rent_body():
+    return {'customer_id': random.randint(1, CUSTOMERS), 'film_id': random.randint(1, FILMS)}
+
+
+def add_customer_body():
+    tag = uuid.uuid4().hex[:12]
+    return {'first_name': 'Bench', 'last_name': tag, 'email': 'bench.%s@example.com' % tag,
+            'phone': '5550100', 'address': '%s Bench Street' % tag, 'address2': '',
+            'district': 'Bench', 'city': 'Benchville', 'country': 'Benchland', 'postal_code': '00000'}
+
+
+SCENARIOS = {
+    'top_films': ('GET', lambda: '/top/rented_films', None),
+    'top_actors': ('GET', lambda: '/top/actors', None),
+    'films': ('GET', lambda: '/films?limit=20', None),
+    'films_search': ('GET', lambda: '/films?search=%s' % random.choice(['an', 'the', 'love', 'ace']), None),
+    'customers': ('GET', lambda: '/customers?limit=50', None),
+    'film_details': ('POST', lambda: '/details/top5films', lambda: {'film_id': random.randint(1, FILMS)}),
+    'film_data': ('POST', lambda: '/details/filmdata', lambda: {'film_id': random.randint(1, FILMS)}),
+    'actor_details': ('POST', lambda: '/details/top5actors', lambda: {'actor_id': random.randint(1, ACTORS)}),
+    'customer_data': ('POST', lambda: '/details/customerdata', lambda: {'customer_id': random.randint(1, CUSTOMERS)}),
+    'availability': ('POST', lambda: '/checkFilmAvailability', lambda: {'film_id': random.randint(1, FILMS)}),
+    'rent': ('POST', lambda: '/rentFilm', rent_body),
+    'return': ('POST', lambda: '/returnFilm', rent_body),
+    'customer_add': ('POST', lambda: '/customer/add', add_customer_body),
+}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return round(sorted_values[index] * 1000, 3)
+
+
+def scrape_queries(url):
+    # Total statements executed so far, from the db_statement_execute_seconds_count series
+    target = urlparse(url)
+    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=10)
+    try:
+        conn.request('GET', '/metrics')
+        body = conn.getresponse().read().decode()
+    finally:
+        conn.close()
+    total = 0
+    for line in body.splitlines():
+        if line.startswith('db_statement_execute_seconds_count'):
+            total += int(float(line.rsplit(' ', 1)[1]))
+    return total
+
+
+def scrape_rows_examined(db_args):
+    # Rows examined by every statement against the sakila schema so far
+    import pymysql
+    db = pymysql.connect(host=db_args.db_host, port=db_args.db_port, user=db_args.db_user,
+                         password=db_args.db_password)
+    try:
+        cursor = db.cursor()
+        cursor.execute("""SELECT COALESCE(SUM(SUM_ROWS_EXAMINED), 0)
+            FROM performance_schema.events_statements_summary_by_digest
+            WHERE SCHEMA_NAME = 'sakila'""")
+        return int(cursor.fetchone()[0])
+    finally:
+        db.close()
+
+
+def worker(url, scenarios, weights, deadline, latencies, errors, lock):
+    target = urlparse(url)
+    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+    local_latencies = []
+    local_errors = 0
+    local_rejected = 0
+    while time.monotonic() < deadline:
+        method, path, body = SCENARIOS[random.choices(scenarios, weights)[0]]
+        payload = json.dumps(body()) if body else None
+        headers = {'Content-Type': 'application/json'} if payload else {}
+        start = time.perf_counter()
+        try:
+            conn.request(method, path(), body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            # 409 is /rentFilm's out-of-stock answer, not a failure; 429/503
+            # come from admission control and are counted on their own
+            if response.status in (429, 503):
+                local_rejected += 1
+            elif response.status >= 400 and response.status != 409:
+                local_errors += 1
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+            continue
+        local_latencies.append(time.perf_counter() - start)
+    conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors[0] += local_errors
+        errors[1] += local_rejected
+
+
+def run_phase(url, scenarios, weights, concurrency, duration, db_args=None):
+    latencies = []
+    errors = [0, 0]
+    lock = threading.Lock()
+    queries_before = scrape_queries(url)
+    rows_before = scrape_rows_examined(db_args) if db_args else None
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [threading.Thread(target=worker, args=(url, scenarios, weights, deadline, latencies, errors, lock))
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    queries = scrape_queries(url) - queries_before
+    rows = scrape_rows_examined(db_args) - rows_before if db_args else None
+
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rejected': errors[1],
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'db_queries_per_request': round(queries / len(latencies), 2) if latencies else None,
+    }
+    if db_args:
+        result['rows_examined_per_request'] = round(rows / len(latencies), 1) if latencies else None
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def print_table(results, baseline):
+    print("%-16s %9s %8s %8s %9s %9s %9s %8s %10s" % ('scenario', 'req/s', 'errors', 'rejected', 'p50 ms',
+                                                    'p95 ms', 'p99 ms', 'q/req', 'rows/req'))
+    for name, r in results.items():
+        line = "%-16s %9s %8s %8s %9s %9s %9s %8s %10s" % (name, r['throughput_rps'], r['errors'],
+                                                            r.get('rejected', 0), r['p50_ms'],
+                                                            r['p95_ms'], r['p99_ms'], r['db_queries_per_request'],
+                                                            r.get('rows_examined_per_request', '-'))
+        old = baseline.get(name)
+        if old and old.get('p95_ms') and r['p95_ms']:
+            line += "   p95 %+.1f%%" % ((r['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100)
+        if old and old.get('rows_examined_per_request') is not None and r.get('rows_examined_per_request') is not None:
+            line += "   rows %s -> %s" % (old['rows_examined_per_request'], r['rows_examined_per_request'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Sakila back end")
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per phase')
+    parser.add_argument('--scenarios', help='comma separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--mix', help='weighted mixed phase, e.g. top_films=5,films=3,rent=1')
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--baseline', help='earlier results file to compare p95 against')
+    parser.add_argument('--rows-examined', action='store_true',
+                        help='report rows examined per request from performance_schema')
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=3306)
+    parser.add_argument('--db-user', default='root')
+    parser.add_argument('--db-password', default='password')
+    args = parser.parse_args()
+    db_args = args if args.rows_examined else None
+
+    names = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    results = {}
+    for name in names:
+        print("Running %s" % name)
+        results[name] = run_phase(args.url, [name], [1], args.concurrency, args.duration, db_args)
+
+    if args.mix:
+        pairs = [item.split('=') for item in args.mix.split(',')]
+        print("Running mixed")
+        results['mixed'] = run_phase(args.url, [p[0] for p in pairs], [float(p[1]) for p in pairs],
+                                     args.concurrency, args.duration, db_args)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'concurrency': args.concurrency,
+        'duration': args.duration,
+        'mix': args.mix,
+        'results': results,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print_table(results, baseline)
+    print("Results written to %s" % args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Seeds a local MySQL/MariaDB with the Sakila sample database and scales it up
+# for benchmarking.
+#
+#   python bench/seed.py --sakila-dir ~/sakila-db --scale 10
+#
+# --sakila-dir points at the unpacked sakila-db download (sakila-schema.sql and
+# sakila-data.sql) and is loaded through the mysql client. --scale N makes N-1
+# extra copies of the stock customers and their rental history, with rental
+# dates shifted back so the copies are all returned rentals. The migrations
+# are applied last; --skip-migrations leaves out the index ones (to measure a
+# stock-schema baseline).
+import argparse
+import os
+import subprocess
+import sys
+
+import pymysql
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import migrate  # noqa: E402
+import stats  # noqa: E402
+
+
+# Migrations the app can't run without, applied even with --skip-migrations
+APP_TABLES = ('0005_jobs', '0008_rental_summary_tables', '0010_table_versions')
+
+
+def load_sakila(args):
+    for name in ('sakila-schema.sql', 'sakila-data.sql'):
+        path = os.path.join(args.sakila_dir, name)
+        print("Loading %s" % path)
+        with open(path, 'rb') as f:
+            subprocess.run(['mysql', '-h', args.host, '-P', str(args.port), '-u', args.user,
+                            '-p' + args.password], stdin=f, check=True)
+
+
+def scale(db, factor):
+    cursor = db.cursor()
+    cursor.execute("SELECT MAX(customer_id) AS n FROM customer")
+    base_customers = cursor.fetchone()['n']
+    cursor.execute("SELECT MAX(rental_id) AS n FROM rental")
+    base_rentals = cursor.fetchone()['n']
+
+    for k in range(1, factor):
+        print("Copy %d/%d" % (k, factor - 1))
+        # Explicit ids keep copy k of customer c at c + k * base_customers
+        cursor.execute("""
+            INSERT INTO customer (customer_id, store_id, first_name, last_name, email, address_id, active, create_date)
+            SELECT customer_id + %s, store_id, first_name, last_name, CONCAT('copy', %s, '.', email),
+                address_id, active, create_date
+            FROM customer WHERE customer_id <= %s
+        """, (k * base_customers, k, base_customers))
+        cursor.execute("""
+            INSERT INTO rental (rental_date, inventory_id, customer_id, return_date, staff_id)
+            SELECT rental_date - INTERVAL %s DAY, inventory_id, customer_id + %s,
+                COALESCE(return_date, rental_date + INTERVAL 3 DAY) - INTERVAL %s DAY, staff_id
+            FROM rental WHERE rental_id <= %s
+        """, (k * 400, k * base_customers, k * 400, base_rentals))
+        db.commit()
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed and scale the Sakila database for benchmarks")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--sakila-dir', help='directory with sakila-schema.sql and sakila-data.sql')
+    parser.add_argument('--scale', type=int, default=1, help='multiply customers and rentals by this factor')
+    parser.add_argument('--skip-migrations', action='store_true', help='leave the stock Sakila indexes')
+    args = parser.parse_args()
+
+    if args.sakila_dir:
+        load_sakila(args)
+
+    db = pymysql.connect(host=args.host, port=args.port, user=args.user, password=args.password,
+                         db='sakila', cursorclass=pymysql.cursors.DictCursor)
+    try:
+        if args.scale > 1:
+            scale(db, args.scale)
+        # Without --skip-migrations every file is applied, otherwise only the
+        # ones creating tables the app needs
+        for version in migrate.migrate(db, None if not args.skip_migrations else APP_TABLES):
+            print("Applied %s" % version)
+        print("Rebuilding rental statistics")
+        stats.rebuild(db)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
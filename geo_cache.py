@@ -0,0 +1,86 @@
+import threading
+from datetime import datetime
+
+
+class GeoCache:
+    # country -> country_id and (city, country_id) -> city_id, warmed from the
+    # small country and city tables so address writes rarely need a lookup.
+    def __init__(self, connect):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._countries = {}
+        self._cities = {}
+        self._loaded = False
+
+    def ensure_loaded(self, cursor=None):
+        # Loads through cursor when given, so a handler that already holds a
+        # connection doesn't borrow a second one from the pool
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            if cursor is not None:
+                countries, cities = self._load(cursor)
+            else:
+                db = self._connect()
+                own = db.cursor()
+                try:
+                    countries, cities = self._load(own)
+                finally:
+                    own.close()
+                    db.close()
+            with self._lock:
+                self._countries = countries
+                self._cities = cities
+                self._loaded = True
+
+    @staticmethod
+    def _load(cursor):
+        cursor.execute("SELECT country_id, country FROM country")
+        countries = {row['country']: row['country_id'] for row in cursor.fetchall()}
+        cursor.execute("SELECT city_id, city, country_id FROM city")
+        cities = {(row['city'], row['country_id']): row['city_id'] for row in cursor.fetchall()}
+        return countries, cities
+
+    def resolve(self, cursor, country, city):
+        # Returns (city_id, pending). Rows inserted here belong to the caller's
+        # transaction, so pass pending to remember() only after it commits.
+        self.ensure_loaded(cursor)
+        pending = []
+
+        with self._lock:
+            country_id = self._countries.get(country)
+        if country_id is None:
+            # Another process may have added it since we warmed up
+            cursor.execute("SELECT country_id FROM country WHERE country = %s", (country,))
+            row = cursor.fetchone()
+            if row:
+                country_id = row['country_id']
+            else:
+                cursor.execute("INSERT INTO country (country, last_update) VALUES (%s, %s)", (country, datetime.utcnow()))
+                country_id = cursor.lastrowid
+            pending.append(('country', country, country_id))
+
+        with self._lock:
+            city_id = self._cities.get((city, country_id))
+        if city_id is None:
+            cursor.execute("SELECT city_id FROM city WHERE city = %s AND country_id = %s", (city, country_id))
+            row = cursor.fetchone()
+            if row:
+                city_id = row['city_id']
+            else:
+                cursor.execute("INSERT INTO city (city, country_id, last_update) VALUES (%s, %s, %s)", (city, country_id, datetime.utcnow()))
+                city_id = cursor.lastrowid
+            pending.append(('city', (city, country_id), city_id))
+
+        return city_id, pending
+
+    def remember(self, pending):
+        with self._lock:
+            for kind, key, value in pending:
+                if kind == 'country':
+                    self._countries[key] = value
+                else:
+                    self._cities[key] = value
@@ -0,0 +1,31 @@
+# Production launcher for asgi.py: gunicorn -c gunicorn.conf.py asgi:app
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8080')
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Every worker holds up to MYSQL_POOL_SIZE + ASYNC_POOL_SIZE connections to the
+# primary (10 + 20 with server.py's defaults; the background indexes and job
+# workers borrow from the first pool). The default worker count keeps the total
+# under MySQL's max_connections, leaving RESERVED_CONNECTIONS for the mysql
+# client, migrations and the like. Raise MYSQL_MAX_CONNECTIONS with the server
+# setting, or CONNECTIONS_PER_WORKER when the pool sizes change.
+MYSQL_MAX_CONNECTIONS = int(os.environ.get('MYSQL_MAX_CONNECTIONS', 151))
+CONNECTIONS_PER_WORKER = int(os.environ.get('CONNECTIONS_PER_WORKER', 10 + 20))
+RESERVED_CONNECTIONS = 10
+
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             max(1, min(multiprocessing.cpu_count() * 2 + 1,
+                                        (MYSQL_MAX_CONNECTIONS - RESERVED_CONNECTIONS) // CONNECTIONS_PER_WORKER))))
+
+# Keep browser connections open between the landing page's parallel fetches
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+
+# Recycle workers now and then so per-process caches and pools start fresh
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = '-'
@@ -0,0 +1,142 @@
+import functools
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, g, request
+
+log = logging.getLogger('sakila.http_cache')
+
+
+class TableVersions:
+    # Version tokens for conditional GETs.
+    #
+    # Tables the app writes (tracked) have a counter row in sakila.table_versions
+    # (migration 0010). bump() increments it in a transaction of its own, so
+    # every worker sees a write made by any of them and the write itself never
+    # queues on the counter. Callers bump once the write and everything derived
+    # from it (summary tables) has committed: a token may lag the data it labels
+    # but never runs ahead of it, which would pin clients to an old body with 304s.
+    #
+    # Other tables are only ever edited by hand and are probed instead with
+    # MAX(last_update) and COUNT(*), cached for probe_interval seconds.
+    def __init__(self, get_db, connect, tracked=(), probe_interval=5):
+        # get_db: the connection the request reads from; connect: a primary
+        # connection the caller owns, for bump()
+        self._get_db = get_db
+        self._connect = connect
+        self.tracked = frozenset(tracked)
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._modified = {}
+        self._probed = {}
+
+    def bump(self, *tables):
+        now = time.time()
+        with self._lock:
+            for table in tables:
+                self._modified[table] = now
+        tables = sorted(set(tables) & self.tracked)
+        if not tables:
+            return
+        db = self._connect()
+        cursor = db.cursor()
+        try:
+            cursor.execute("""INSERT INTO sakila.table_versions (table_name, version) VALUES %s
+                ON DUPLICATE KEY UPDATE version = version + 1""" % ", ".join(["(%s, 1)"] * len(tables)), tables)
+            db.commit()
+        except Exception:
+            # The write itself stands; its readers keep the old token until the next bump
+            db.rollback()
+            log.exception("could not bump the version of %s", ", ".join(tables))
+        finally:
+            cursor.close()
+            db.close()
+
+    def last_write(self, tables):
+        # Unix time of the latest bump() of any of the tables in this process, or None
+        with self._lock:
+            return max([self._modified[t] for t in tables if t in self._modified], default=None)
+
+    def current(self, tables):
+        # Returns (token, last_modified as a unix timestamp)
+        counted = [t for t in tables if t in self.tracked]
+        probed = tuple(t for t in tables if t not in self.tracked)
+        parts, modified = [], 0
+        if counted:
+            db = self._get_db()
+            cursor = db.cursor()
+            cursor.execute("""SELECT table_name, version, UNIX_TIMESTAMP(updated_at) AS modified
+                FROM sakila.table_versions WHERE table_name IN %s""", (counted,))
+            rows = {row['table_name']: row for row in cursor.fetchall()}
+            cursor.close()
+            parts.append('.'.join(str(rows[t]['version'] if t in rows else 0) for t in counted))
+            modified = max([float(rows[t]['modified']) for t in counted if t in rows], default=0)
+        if probed:
+            token, probe_modified = self._probe(probed)
+            parts.append(token)
+            modified = max(modified, probe_modified)
+        return '-'.join(parts), modified
+
+    def _probe(self, tables):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._probed.get(tables)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        db = self._get_db()
+        cursor = db.cursor()
+        cursor.execute(" UNION ALL ".join(
+            "SELECT UNIX_TIMESTAMP(MAX(last_update)) AS modified, COUNT(*) AS row_count FROM sakila.%s" % t
+            for t in tables))
+        rows = cursor.fetchall()
+        cursor.close()
+        token = '.'.join('%s:%s' % (row['modified'], row['row_count']) for row in rows)
+        result = token, max([float(row['modified'] or 0) for row in rows])
+        with self._lock:
+            self._probed[tables] = (now + self.probe_interval, result)
+        return result
+
+
+def conditional(versions, tables, max_age=0, extra=None):
+    # Answers If-None-Match / If-Modified-Since with 304 before the view runs.
+    # The view finds the token in g.version_token, to key anything it caches.
+    # extra() may return (token, last_modified) of another source the body
+    # depends on for this request, or None.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            token, modified = versions.current(tables)
+            other = extra() if extra is not None else None
+            if other is not None:
+                token = '%s|%s' % (token, other[0])
+                modified = max(modified, other[1])
+            g.version_token = token
+            # The body also depends on the query string and the negotiated format
+            etag = hashlib.sha1(('%s|%s|%s' % (token, request.full_path, request.accept_mimetypes))
+                                .encode()).hexdigest()[:20]
+            last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = since is not None and last_modified <= since
+
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            response.cache_control.must_revalidate = True
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,161 @@
+import json
+import logging
+import threading
+
+# Background jobs backed by the sakila.jobs table (migrations/0005_jobs.sql).
+#
+#   @job_queue.handler('delete_customer')
+#   def delete_customer_job(job, payload):
+#       ...
+#       job.progress(rentals=n)
+#       return {'deleted': True}
+#
+#   job_id = job_queue.submit('delete_customer', {'customer_id': 5})
+#
+# Every process runs its own worker threads; a queued row is claimed with
+# FOR UPDATE SKIP LOCKED, so several processes can share the table. A running
+# job whose heartbeat (updated_at, bumped by progress()) is older than
+# stale_after seconds is assumed lost with its process and queued again, so
+# handlers must be safe to re-run.
+
+log = logging.getLogger('sakila.jobs')
+
+
+class Job:
+    def __init__(self, queue, job_id, kind):
+        self._queue = queue
+        self.job_id = job_id
+        self.kind = kind
+
+    def progress(self, **fields):
+        self._queue._update(self.job_id, "progress = %s", json.dumps(fields))
+
+
+class JobQueue:
+    def __init__(self, connect, workers=2, poll_interval=1, stale_after=300):
+        self._connect = connect
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._handlers = {}
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._started = False
+
+    def handler(self, kind):
+        def decorator(fn):
+            self._handlers[kind] = fn
+            return fn
+        return decorator
+
+    def ensure_started(self):
+        with self._wakeup:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name='job-worker-%d' % i, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind, payload):
+        if kind not in self._handlers:
+            raise ValueError("No handler for job kind %r" % kind)
+        db = self._connect()
+        cursor = db.cursor()
+        try:
+            cursor.execute("""INSERT INTO sakila.jobs (kind, payload, status, created_at, updated_at)
+                VALUES (%s, %s, 'queued', NOW(), NOW())""", (kind, json.dumps(payload)))
+            job_id = cursor.lastrowid
+            db.commit()
+        finally:
+            cursor.close()
+            db.close()
+        self.ensure_started()
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        db = self._connect()
+        cursor = db.cursor()
+        try:
+            cursor.execute("""SELECT job_id, kind, payload, status, progress, result, error, attempts,
+                created_at, started_at, updated_at, finished_at
+                FROM sakila.jobs WHERE job_id = %s""", (job_id,))
+            job = cursor.fetchone()
+        finally:
+            cursor.close()
+            db.close()
+        if job is not None:
+            for key in ('payload', 'progress', 'result'):
+                if job[key] is not None:
+                    job[key] = json.loads(job[key])
+        return job
+
+    def _work(self):
+        while True:
+            try:
+                claimed = self._claim()
+            except Exception:
+                log.exception("could not claim a job")
+                claimed = None
+            if claimed is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            try:
+                self._run(*claimed)
+            except Exception:
+                # Couldn't record the outcome; the stale check will queue it again
+                log.exception("could not record the outcome of job %s", claimed[0])
+
+    def _claim(self):
+        # Returns (job_id, kind, payload) for the oldest queued job, marked running
+        db = self._connect()
+        cursor = db.cursor()
+        try:
+            cursor.execute("""UPDATE sakila.jobs SET status = 'queued'
+                WHERE status = 'running' AND updated_at < NOW() - INTERVAL %s SECOND""", (self.stale_after,))
+            db.commit()
+            cursor.execute("""SELECT job_id, kind, payload FROM sakila.jobs
+                WHERE status = 'queued' ORDER BY job_id LIMIT 1
+                FOR UPDATE SKIP LOCKED""")
+            row = cursor.fetchone()
+            if row is None:
+                db.rollback()
+                return None
+            cursor.execute("""UPDATE sakila.jobs
+                SET status = 'running', attempts = attempts + 1, started_at = NOW(), updated_at = NOW()
+                WHERE job_id = %s""", (row['job_id'],))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+            db.close()
+        return row['job_id'], row['kind'], json.loads(row['payload'])
+
+    def _run(self, job_id, kind, payload):
+        handler = self._handlers.get(kind)
+        try:
+            if handler is None:
+                raise ValueError("No handler for job kind %r" % kind)
+            result = handler(Job(self, job_id, kind), payload)
+        except Exception as e:
+            self._update(job_id, "status = 'failed', error = %s, finished_at = NOW()",
+                         '%s: %s' % (type(e).__name__, e))
+            return
+        self._update(job_id, "status = 'done', result = %s, finished_at = NOW()", json.dumps(result))
+
+    def _update(self, job_id, assignments, value):
+        db = self._connect()
+        cursor = db.cursor()
+        try:
+            cursor.execute("UPDATE sakila.jobs SET %s, updated_at = NOW() WHERE job_id = %%s" % assignments,
+                           (value, job_id))
+            db.commit()
+        finally:
+            cursor.close()
+            db.close()
@@ -0,0 +1,53 @@
+import datetime
+import decimal
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COLUMNAR_MIMETYPE = 'application/vnd.sakila.columnar+json'
+
+
+def _default(obj):
+    # Types orjson doesn't know; Decimal stays a string like Flask's default encoder
+    if isinstance(obj, datetime.date):
+        # Same RFC 822 form Flask's encoder writes, so switching providers doesn't change payloads
+        return http_date(obj)
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', 'replace')
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Much faster than the default provider on long lists of row dicts. Dates
+    # are passed through to _default rather than encoded as ISO 8601. Only the
+    # compact output path is used.
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=_default, option=self.option),
+                                        mimetype=self.mimetype)
+
+
+def columnar(rows, columns=None):
+    # {"columns": [...], "rows": [[...], ...]}: key names are sent once instead of per row
+    if columns is None:
+        columns = list(rows[0]) if rows else []
+    return {'columns': columns, 'rows': [[row[c] for c in columns] for row in rows]}
@@ -0,0 +1,174 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+
+import pymysql
+
+slow_query_log = logging.getLogger('sakila.slow_query')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            for label_values, (counts, count, total) in sorted(self._series.items()):
+                labels = ','.join('%s="%s"' % (k, _escape(v)) for k, v in zip(self.labels, label_values))
+                sep = ',' if labels else ''
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append('%s_bucket{%s%sle="%s"} %d' % (self.name, labels, sep, bound, bucket_count))
+                lines.append('%s_bucket{%s%sle="+Inf"} %d' % (self.name, labels, sep, count))
+                braces = '{%s}' % labels if labels else ''
+                lines.append('%s_sum%s %s' % (self.name, braces, repr(total)))
+                lines.append('%s_count%s %d' % (self.name, braces, count))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s counter' % self.name]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                labels = ','.join('%s="%s"' % (k, _escape(v)) for k, v in zip(self.labels, label_values))
+                lines.append('%s{%s} %s' % (self.name, labels, value))
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+request_latency = Histogram('http_request_duration_seconds', 'Request latency by route.',
+                            ('method', 'route', 'status'), LATENCY_BUCKETS)
+response_size = Histogram('http_response_size_bytes', 'Response body size by route.',
+                          ('method', 'route'), SIZE_BUCKETS)
+db_acquire = Histogram('db_connection_acquire_seconds', 'Time spent waiting for a pooled connection.',
+                       (), LATENCY_BUCKETS)
+sql_execute = Histogram('db_statement_execute_seconds', 'Statement execution time.',
+                        ('statement',), LATENCY_BUCKETS)
+sql_fetch = Histogram('db_statement_fetch_seconds', 'Time spent fetching result rows.',
+                      ('statement',), LATENCY_BUCKETS)
+sql_rows = Counter('db_statement_rows_total', 'Rows fetched or affected per statement.', ('statement',))
+admission_rejections = Counter('admission_rejections_total', 'Requests turned away by admission control.',
+                               ('route_class', 'reason'))
+
+ALL = [request_latency, response_size, db_acquire, sql_execute, sql_fetch, sql_rows, admission_rejections]
+
+# Slow query log threshold in seconds, None turns it off
+slow_query_threshold = None
+
+
+def render():
+    lines = []
+    for metric in ALL:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+_placeholder_list = re.compile(r'\(\s*%s(\s*,\s*%s)*\s*\)(\s*,\s*\(\s*%s(\s*,\s*%s)*\s*\))*')
+_repeated_tuple = re.compile(r'(\((?:[^()]|\([^()]*\))*\))(?:\s*,\s*\1)+')
+_union_list = re.compile(r'( UNION ALL SELECT %s AS k, %s AS n)+')
+_whitespace = re.compile(r'\s+')
+
+
+def statement_label(query):
+    # Collapse whitespace, multi-row VALUES and expanded IN/UNION lists so one template maps to one
+    # series; the hash tells apart statements that share their first 100 chars
+    label = _whitespace.sub(' ', query).strip()
+    label = _placeholder_list.sub('(...)', label)
+    label = _repeated_tuple.sub(r'\1, ...', label)
+    label = _union_list.sub(' UNION ALL ...', label)
+    return '%s #%s' % (label[:100], hashlib.sha1(label.encode()).hexdigest()[:8])
+
+
+class InstrumentedDictCursor(pymysql.cursors.DictCursor):
+    # Records execute/fetch time and row counts for every statement. Set label
+    # on a cursor that runs SQL assembled per request, so all its variants
+    # share one series.
+    label = None
+    _label = None
+    _in_many = False
+
+    def execute(self, query, args=None):
+        if self._in_many:
+            return super().execute(query, args)
+        self._label = self.label or statement_label(query)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            elapsed = time.perf_counter() - start
+            sql_execute.observe(elapsed, self._label)
+            if self.rowcount and self.rowcount > 0:
+                sql_rows.inc(self.rowcount, self._label)
+            if slow_query_threshold is not None and elapsed >= slow_query_threshold:
+                slow_query_log.warning("%.1f ms rows=%s %s", elapsed * 1000, self.rowcount, self._label)
+
+    def executemany(self, query, args):
+        # pymysql's executemany calls execute() with the expanded SQL; time the
+        # whole batch once under the template's label instead
+        label = self.label or statement_label(query)
+        self._in_many = True
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, args)
+        finally:
+            self._in_many = False
+            self._label = label
+            elapsed = time.perf_counter() - start
+            sql_execute.observe(elapsed, label)
+            if self.rowcount and self.rowcount > 0:
+                sql_rows.inc(self.rowcount, label)
+            if slow_query_threshold is not None and elapsed >= slow_query_threshold:
+                slow_query_log.warning("%.1f ms rows=%s %s", elapsed * 1000, self.rowcount, label)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._label is not None:
+                sql_fetch.observe(time.perf_counter() - start, self._label)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
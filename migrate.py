@@ -0,0 +1,90 @@
+# Schema migrations: numbered .sql files in migrations/, applied in order and
+# recorded in sakila.schema_migrations.
+#
+#   flask --app server migrate            apply pending files, then verify
+#   flask --app server migrate --check    only verify
+#
+# A "-- verify: <query name> <index>" line in a file says which catalog query
+# the index is for; verify() EXPLAINs that query and reports whether MySQL
+# actually picks the index. A .py file is a data step: its up(db) runs and
+# commits its own work.
+import importlib.util
+import os
+import re
+
+import queries
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+_verify_line = re.compile(r'^--\s*verify:\s*(\w+)\s+(\w+)\s*$', re.MULTILINE)
+_comment_line = re.compile(r'^\s*--.*$', re.MULTILINE)
+
+
+def migrations():
+    # [(version, path)] sorted by file name, version is the file name without .sql
+    names = sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith(('.sql', '.py')))
+    return [(os.path.splitext(name)[0], os.path.join(MIGRATIONS_DIR, name)) for name in names]
+
+
+def statements(path):
+    with open(path) as f:
+        sql = _comment_line.sub('', f.read())
+    return [statement.strip() for statement in sql.split(';') if statement.strip()]
+
+
+def run_step(db, path):
+    spec = importlib.util.spec_from_file_location('migration_' + os.path.basename(path)[:-3], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.up(db)
+
+
+def expectations(path):
+    with open(path) as f:
+        return _verify_line.findall(f.read())
+
+
+def applied(cursor):
+    cursor.execute("""CREATE TABLE IF NOT EXISTS sakila.schema_migrations (
+        version VARCHAR(255) NOT NULL PRIMARY KEY,
+        applied_at DATETIME NOT NULL
+    )""")
+    cursor.execute("SELECT version FROM sakila.schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+
+def migrate(db, versions=None):
+    # DDL commits implicitly in MySQL, so each file is recorded right after it
+    # runs; a failure leaves the earlier files applied and this one pending.
+    # versions limits the run to those files.
+    cursor = db.cursor()
+    ran = []
+    try:
+        done = applied(cursor)
+        for version, path in migrations():
+            if version in done or (versions is not None and version not in versions):
+                continue
+            if path.endswith('.py'):
+                run_step(db, path)
+            else:
+                for statement in statements(path):
+                    cursor.execute(statement)
+            cursor.execute("INSERT INTO sakila.schema_migrations (version, applied_at) VALUES (%s, NOW())",
+                           (version,))
+            db.commit()
+            ran.append(version)
+    finally:
+        cursor.close()
+    return ran
+
+
+def verify(db):
+    # Returns [(version, query name, index, used)] for every verify line
+    queries.check_plans(db)
+    results = []
+    for version, path in migrations():
+        for name, index in expectations(path):
+            plan = queries.CATALOG[name].plan or []
+            used = any(row.get('key') == index for row in plan)
+            results.append((version, name, index, used))
+    return results
@@ -0,0 +1,8 @@
+-- Open rentals (return_date IS NULL) as one contiguous index range.
+-- MySQL has no partial indexes, and the optimizer only substitutes a generated
+-- column for comparisons, not IS NULL, so a functional index would need every
+-- query rewritten. Leading with return_date puts all open rentals first and
+-- IS NULL is a ref lookup; inventory_id makes it covering for the availability load.
+-- verify: inventory_status idx_rental_open
+ALTER TABLE sakila.rental
+    ADD INDEX idx_rental_open (return_date, inventory_id);
@@ -0,0 +1,8 @@
+-- "Is this copy out?" lookups: inventory_id = ? AND return_date IS NULL.
+-- Replaces idx_fk_inventory_id, which the foreign key can use instead.
+-- verify: rent_inventory idx_rental_inventory_return
+-- verify: open_inventory idx_rental_inventory_return
+-- verify: claim_inventory idx_rental_inventory_return
+ALTER TABLE sakila.rental
+    ADD INDEX idx_rental_inventory_return (inventory_id, return_date),
+    DROP INDEX idx_fk_inventory_id;
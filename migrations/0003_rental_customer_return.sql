@@ -0,0 +1,8 @@
+-- A customer's open or returned rentals: customer_id = ? AND return_date IS NULL.
+-- Replaces idx_fk_customer_id, which the foreign key can use instead.
+-- verify: customer_rentals_chunk idx_rental_customer_return
+-- verify: oldest_open_rental idx_rental_customer_return
+-- verify: open_rentals_for_customers idx_rental_customer_return
+ALTER TABLE sakila.rental
+    ADD INDEX idx_rental_customer_return (customer_id, return_date),
+    DROP INDEX idx_fk_customer_id;
@@ -0,0 +1,6 @@
+-- add_customer and updateCustomer look customers up by email before every write.
+-- Unique, so two concurrent sign-ups with the same email can't both insert.
+-- Fails if the table already holds duplicate emails; clean those up first.
+-- verify: email_exists idx_customer_email
+ALTER TABLE sakila.customer
+    ADD UNIQUE INDEX idx_customer_email (email);
@@ -0,0 +1,17 @@
+-- Background jobs (jobs.py). Workers claim queued rows with FOR UPDATE SKIP LOCKED,
+-- so the (status, job_id) index keeps the claim off a table scan.
+CREATE TABLE IF NOT EXISTS sakila.jobs (
+    job_id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    kind VARCHAR(64) NOT NULL,
+    payload JSON NOT NULL,
+    status ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'queued',
+    progress JSON NULL,
+    result JSON NULL,
+    error TEXT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    created_at DATETIME NOT NULL,
+    started_at DATETIME NULL,
+    updated_at DATETIME NOT NULL,
+    finished_at DATETIME NULL,
+    KEY idx_jobs_status (status, job_id)
+);
@@ -0,0 +1,8 @@
+-- The film search index refreshes from rows whose last_update moved past its
+-- watermark; without these each refresh scans film, film_actor and film_category.
+-- verify: changed_films idx_film_actor_last_update
+ALTER TABLE sakila.film ADD INDEX idx_film_last_update (last_update);
+ALTER TABLE sakila.film_actor ADD INDEX idx_film_actor_last_update (last_update);
+ALTER TABLE sakila.film_category ADD INDEX idx_film_category_last_update (last_update);
+ALTER TABLE sakila.actor ADD INDEX idx_actor_last_update (last_update);
+ALTER TABLE sakila.category ADD INDEX idx_category_last_update (last_update);
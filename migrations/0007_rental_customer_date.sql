@@ -0,0 +1,6 @@
+-- Rental history: customer_id = ? ORDER BY rental_date DESC, rental_id DESC,
+-- walked backwards from a keyset cursor. rental_id is listed explicitly so the
+-- index order matches the ORDER BY (no filesort of the whole history), and
+-- return_date rides along so the open/returned filter is checked in the index.
+ALTER TABLE sakila.rental
+    ADD INDEX idx_rental_customer_date (customer_id, rental_date, rental_id, return_date);
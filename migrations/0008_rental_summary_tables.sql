@@ -0,0 +1,24 @@
+-- Summary tables behind the leaderboards and the customer details (stats.py).
+-- 0009 fills them from the current rentals.
+CREATE TABLE IF NOT EXISTS sakila.film_rental_counts (
+    film_id SMALLINT UNSIGNED NOT NULL PRIMARY KEY,
+    rentals INT NOT NULL DEFAULT 0,
+    KEY idx_rentals (rentals)
+);
+CREATE TABLE IF NOT EXISTS sakila.actor_film_counts (
+    actor_id SMALLINT UNSIGNED NOT NULL PRIMARY KEY,
+    films INT NOT NULL DEFAULT 0,
+    KEY idx_films (films)
+);
+CREATE TABLE IF NOT EXISTS sakila.actor_film_rental_counts (
+    actor_id SMALLINT UNSIGNED NOT NULL,
+    film_id SMALLINT UNSIGNED NOT NULL,
+    rentals INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (actor_id, film_id),
+    KEY idx_actor_rentals (actor_id, rentals)
+);
+CREATE TABLE IF NOT EXISTS sakila.customer_rental_counts (
+    customer_id SMALLINT UNSIGNED NOT NULL PRIMARY KEY,
+    rented INT NOT NULL DEFAULT 0,
+    renting INT NOT NULL DEFAULT 0
+);
@@ -0,0 +1,7 @@
+# Fills the summary tables created by 0008 with the same statements as
+# `flask --app server rebuild-stats`.
+import stats
+
+
+def up(db):
+    stats.rebuild(db)
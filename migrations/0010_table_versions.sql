@@ -0,0 +1,9 @@
+-- Version counters behind the ETags of the rental and customer reads
+-- (http_cache.TableVersions). Every process bumps them after its writes
+-- commit, so a 304 from one worker never hides a write made through another.
+CREATE TABLE IF NOT EXISTS sakila.table_versions (
+    table_name VARCHAR(64) NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
+);
+INSERT IGNORE INTO sakila.table_versions (table_name) VALUES ('rental'), ('customer');
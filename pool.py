@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+
+# Seconds of checkouts behind checkouts_per_sec
+RATE_WINDOW = 60
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    # Thin wrapper around a pymysql connection. Calling close() hands the
+    # connection back to the pool instead of closing the socket, so the
+    # existing handlers (cursor.close(); db.close()) keep working unchanged.
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.released = True
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self, discard=False):
+        if not self.released:
+            self._pool.release(self, discard=discard)
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size=10, max_lifetime=1800, idle_timeout=300,
+                 acquire_timeout=10, ping_interval=5):
+        self._connect = connect
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.ping_interval = ping_interval
+
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        # Counters for /pool/stats
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent = deque()
+
+    def _expired(self, conn, now):
+        if self.max_lifetime and now - conn.created_at > self.max_lifetime:
+            return True
+        if self.idle_timeout and now - conn.last_used > self.idle_timeout:
+            return True
+        return False
+
+    def _discard(self, conn):
+        try:
+            conn._raw.close()
+        except Exception:
+            pass
+
+    def _trim_recent(self, now):
+        # Called with the lock held; forgets checkouts older than RATE_WINDOW
+        while self._recent and now - self._recent[0] > RATE_WINDOW:
+            self._recent.popleft()
+
+    def _evict_idle(self, now):
+        # Called with the lock held; drops idle connections past their lifetime
+        stale = [c for c in self._idle if self._expired(c, now)]
+        for conn in stale:
+            self._idle.remove(conn)
+        return stale
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        conn = None
+        # Evicted on every pass while waiting, closed outside the lock
+        stale = []
+        timed_out = False
+        with self._cond:
+            while True:
+                stale.extend(self._evict_idle(time.monotonic()))
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    timed_out = True
+                    break
+                self._cond.wait(remaining)
+            if not timed_out:
+                self._in_use += 1
+
+        for c in stale:
+            self._discard(c)
+        if timed_out:
+            raise PoolTimeout("No database connection available within %ss" % self.acquire_timeout)
+
+        try:
+            if conn is None:
+                conn = PooledConnection(self, self._connect())
+            elif time.monotonic() - conn.last_used > self.ping_interval:
+                # Health check: reconnects transparently if the server dropped us
+                conn._raw.ping(reconnect=True)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            if conn is not None:
+                self._discard(conn)
+            raise
+
+        now = time.monotonic()
+        waited = now - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._recent.append(now)
+            self._trim_recent(now)
+        conn.released = False
+        conn.last_used = now
+        return conn
+
+    def release(self, conn, discard=False):
+        conn.released = True
+        conn.last_used = time.monotonic()
+        if not discard:
+            try:
+                # End any open transaction so the next borrower gets a fresh snapshot
+                conn._raw.rollback()
+            except Exception:
+                discard = True
+        if not discard and self._expired(conn, conn.last_used):
+            discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if not discard:
+                self._idle.append(conn)
+            self._cond.notify()
+        if discard:
+            self._discard(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            self._trim_recent(now)
+            checkouts = self._checkouts
+            return {
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': checkouts,
+                'checkouts_per_sec': round(len(self._recent) / float(RATE_WINDOW), 3),
+                'timeouts': self._timeouts,
+                'avg_wait_ms': round(self._wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                'max_wait_ms': round(self._wait_max * 1000, 3),
+            }
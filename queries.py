@@ -0,0 +1,417 @@
+# Query catalog: every fixed-shape statement the app runs, with a name, the
+# type of each parameter and sample arguments for the EXPLAIN self-check.
+#
+#   queries.FILM_DETAILS.run(cursor, film_id)
+#
+# Statements whose text is assembled per request (the /films and /customers
+# filters, the bulk address lookup, the stats derived tables) stay next to the
+# code that builds them, as do the bookkeeping statements of migrate.py and
+# jobs.py.
+
+CATALOG = {}
+
+
+def ids(value):
+    return [int(v) for v in value]
+
+
+def strs(value):
+    return [str(v) for v in value]
+
+
+class Query:
+    def __init__(self, name, sql, params=(), sample=None):
+        self.name = name
+        self.sql = sql
+        self.params = params
+        self.sample = sample
+        self.plan = None
+        self.warnings = []
+
+    def bind(self, args):
+        # Coerce each argument to its declared type, None stays NULL
+        if len(args) != len(self.params):
+            raise TypeError("%s takes %d parameters, got %d" % (self.name, len(self.params), len(args)))
+        return tuple(None if value is None else kind(value) for kind, value in zip(self.params, args))
+
+    def run(self, cursor, *args):
+        cursor.execute(self.sql, self.bind(args))
+        return cursor
+
+    def run_many(self, cursor, rows):
+        # Sends one multi-row INSERT. cursor.executemany() only batches when the
+        # VALUES tuple is all placeholders, ours contain NOW() and POINT(0,0).
+        if not rows:
+            return cursor
+        head, values, row_sql = self.sql.rpartition('VALUES')
+        row_sql = row_sql.strip().rstrip(';')
+        cursor.execute(head + values + ' ' + ', '.join([row_sql] * len(rows)),
+                       [value for row in rows for value in self.bind(row)])
+        return cursor
+
+
+def query(name, sql, params=(), sample=None):
+    q = CATALOG[name] = Query(name, sql, params, sample)
+    return q
+
+
+# Landing page
+
+TOP_FILMS = query('top_films', """SELECT f.film_id, f.title, c.name AS category_name,
+                    frc.rentals AS rented FROM sakila.film_rental_counts frc
+                    JOIN sakila.film f ON frc.film_id = f.film_id
+                    JOIN sakila.film_category fc ON f.film_id = fc.film_id
+                    JOIN sakila.category c ON fc.category_id = c.category_id
+                    ORDER BY frc.rentals DESC LIMIT 5;""", sample=())
+
+FILM_DETAILS = query('film_details', """SELECT * FROM sakila.film WHERE film_id = %s;""",
+                     (int,), sample=(1,))
+
+TOP_ACTORS = query('top_actors', """SELECT actor.actor_id, actor.first_name, actor.last_name,
+                    afc.films AS movies
+                    FROM sakila.actor_film_counts afc
+                    JOIN sakila.actor on actor.actor_id = afc.actor_id
+                    ORDER BY afc.films DESC LIMIT 5;""", sample=())
+
+ACTOR_DETAILS = query('actor_details', """
+                WITH actor_details AS (
+                    SELECT actor_id, first_name, last_name, last_update
+                    FROM sakila.actor
+                    WHERE actor_id = %s
+                ),
+                top_rented_movies AS (
+                    SELECT f.film_id, f.title, afrc.rentals AS rental_count
+                    FROM sakila.actor_film_rental_counts afrc
+                    JOIN sakila.film f ON afrc.film_id = f.film_id
+                    WHERE afrc.actor_id = %s AND afrc.rentals > 0
+                    ORDER BY afrc.rentals DESC
+                    LIMIT 5
+                )
+                SELECT
+                    a.actor_id, a.first_name, a.last_name, a.last_update,
+                    m.film_id, m.title, m.rental_count
+                FROM actor_details a
+                LEFT JOIN top_rented_movies m ON 1=1;
+                """, (int, int), sample=(1, 1))
+
+# Films page
+
+FILM_LIST_DETAILS = query('film_list_details', """SELECT f.film_id, f.title, f.release_year,
+                        GROUP_CONCAT(DISTINCT c.name ORDER BY c.name SEPARATOR ', ') AS genres,
+                        GROUP_CONCAT(DISTINCT CONCAT(a.first_name, ' ', a.last_name) ORDER BY a.last_name SEPARATOR ', ') AS actors
+                        FROM sakila.film f
+                        LEFT JOIN sakila.film_actor fa ON f.film_id = fa.film_id
+                        LEFT JOIN sakila.actor a ON fa.actor_id = a.actor_id
+                        LEFT JOIN sakila.film_category fc ON f.film_id = fc.film_id
+                        LEFT JOIN sakila.category c ON fc.category_id = c.category_id
+                        WHERE f.film_id IN %s
+                        GROUP BY f.film_id, f.title, f.release_year
+                        ORDER BY f.title, f.film_id""", (ids,), sample=([1, 2, 3],))
+
+# Film page details; FILM_DATA_BATCH fills in "IN %s" for several films
+FILM_DATA_SELECT = """SELECT f.title, f.film_id, f.description, f.release_year, f.rental_duration, f.rental_rate, f.length, f.replacement_cost,
+                    f.rating, f.special_features,f.last_update,
+                    GROUP_CONCAT(DISTINCT CONCAT(a.first_name, ' ', a.last_name) ORDER BY a.last_name SEPARATOR ', ') AS actors
+                    FROM sakila.film f
+                    JOIN sakila.film_actor fa ON f.film_id = fa.film_id
+                    JOIN sakila.actor a ON fa.actor_id = a.actor_id
+                    WHERE f.film_id %s
+                    GROUP BY f.title, f.film_id, f.description, f.release_year, f.rental_duration, f.rental_rate,
+                            f.length, f.replacement_cost, f.rating, f.special_features, f.last_update"""
+
+FILM_DATA = query('film_data', FILM_DATA_SELECT % "= %s", (int,), sample=(1,))
+
+# Locks up to n copies of the film that have no open rental. Copies locked by
+# other allocations are skipped rather than waited on. The outer FOR UPDATE does
+# not lock the rental rows read by the subquery.
+CLAIM_INVENTORY = query('claim_inventory', """
+    SELECT i.inventory_id
+    FROM sakila.inventory i
+    WHERE i.film_id = %s
+    AND NOT EXISTS (
+        SELECT 1 FROM sakila.rental r
+        WHERE r.inventory_id = i.inventory_id AND r.return_date IS NULL
+    )
+    ORDER BY i.inventory_id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+    """, (int, int), sample=(1, 1))
+
+RENT_INVENTORY = query('rent_inventory', """
+    INSERT INTO sakila.rental (customer_id, inventory_id, rental_date, return_date, staff_id)
+    SELECT %s, %s, NOW(), NULL, 1
+    FROM DUAL
+    WHERE NOT EXISTS (
+        SELECT 1 FROM sakila.rental r
+        WHERE r.inventory_id = %s AND r.return_date IS NULL
+    );
+    """, (int, int, int), sample=(1, 1, 1))
+
+# Film search index (search.py): one document per film with its actor and category names
+
+SEARCH_DOCUMENT_SELECT = """SELECT f.film_id, f.title, f.description,
+                        GROUP_CONCAT(DISTINCT CONCAT(a.first_name, ' ', a.last_name) SEPARATOR '|') AS actors,
+                        GROUP_CONCAT(DISTINCT c.name SEPARATOR '|') AS categories
+                        FROM sakila.film f
+                        LEFT JOIN sakila.film_actor fa ON f.film_id = fa.film_id
+                        LEFT JOIN sakila.actor a ON fa.actor_id = a.actor_id
+                        LEFT JOIN sakila.film_category fc ON f.film_id = fc.film_id
+                        LEFT JOIN sakila.category c ON fc.category_id = c.category_id
+                        %s
+                        GROUP BY f.film_id, f.title, f.description"""
+
+SEARCH_DOCUMENTS = query('search_documents', SEARCH_DOCUMENT_SELECT % "")
+
+SEARCH_DOCUMENTS_FOR = query('search_documents_for', SEARCH_DOCUMENT_SELECT % "WHERE f.film_id IN %s",
+                             (ids,), sample=([1, 2, 3],))
+
+# Films touched since a last_update watermark, directly or through a renamed actor/category
+CHANGED_FILMS = query('changed_films', """
+                    SELECT film_id FROM sakila.film WHERE last_update >= %s
+                    UNION SELECT film_id FROM sakila.film_actor WHERE last_update >= %s
+                    UNION SELECT film_id FROM sakila.film_category WHERE last_update >= %s
+                    UNION SELECT fa.film_id FROM sakila.actor a
+                        JOIN sakila.film_actor fa ON a.actor_id = fa.actor_id WHERE a.last_update >= %s
+                    UNION SELECT fc.film_id FROM sakila.category c
+                        JOIN sakila.film_category fc ON c.category_id = fc.category_id WHERE c.last_update >= %s
+                """, (str, str, str, str, str), sample=('2030-01-01',) * 5)
+
+DB_NOW = query('db_now', "SELECT NOW() AS now", sample=())
+
+# Customers page
+
+INSERT_ADDRESS_IF_NEW = query('insert_address_if_new', """
+    INSERT INTO address (address, address2, district, city_id, postal_code, phone, location, last_update)
+    SELECT %s, %s, %s, %s, %s, %s, POINT(0,0), NOW() FROM DUAL
+    WHERE NOT EXISTS (SELECT 1 FROM address WHERE address = %s AND city_id = %s)
+""", (str, str, str, int, str, str, str, int), sample=('47 MySakila Drive', None, 'Alberta', 300, '', '', '47 MySakila Drive', 300))
+
+ADDRESS_ID = query('address_id', "SELECT address_id FROM address WHERE address = %s AND city_id = %s",
+                   (str, int), sample=('47 MySakila Drive', 300))
+
+INSERT_CUSTOMER_IF_NEW_EMAIL = query('insert_customer_if_new_email', """
+            INSERT INTO customer (store_id, first_name, last_name, email, address_id, active, create_date, last_update)
+            SELECT %s, %s, %s, %s, %s, %s, NOW(), NOW() FROM DUAL
+            WHERE NOT EXISTS (SELECT 1 FROM customer WHERE email = %s)
+        """, (int, str, str, str, int, int, str),
+        sample=(1, 'MARY', 'SMITH', 'MARY.SMITH@sakilacustomer.org', 5, 1, 'MARY.SMITH@sakilacustomer.org'))
+
+CUSTOMER_FOR_UPDATE = query('customer_for_update', """
+            SELECT c.email, c.address_id,
+                (SELECT a.address_id FROM address a WHERE a.address = %s AND a.city_id = %s LIMIT 1) AS match_address_id
+            FROM customer c
+            WHERE c.customer_id = %s
+            FOR UPDATE
+        """, (str, int, int), sample=('47 MySakila Drive', 300, 1))
+
+EMAIL_EXISTS = query('email_exists', "SELECT email FROM customer WHERE email = %s",
+                     (str,), sample=('MARY.SMITH@sakilacustomer.org',))
+
+UPDATE_CUSTOMER_AND_ADDRESS = query('update_customer_and_address', """
+                UPDATE customer c
+                JOIN address a ON a.address_id = %s
+                SET a.address = %s, a.address2 = %s, a.district = %s, a.postal_code = %s, a.phone = %s, a.last_update = NOW(),
+                    c.first_name = %s, c.last_name = %s, c.email = %s, c.address_id = a.address_id, c.last_update = NOW()
+                WHERE c.customer_id = %s
+            """, (int, str, str, str, str, str, str, str, str, int),
+            sample=(5, '1913 Hanoi Way', None, 'Nagasaki', '35200', '28303384290', 'MARY', 'SMITH',
+                    'MARY.SMITH@sakilacustomer.org', 1))
+
+INSERT_ADDRESS = query('insert_address', """
+                INSERT INTO address (address, address2, district, city_id, postal_code, phone, location, last_update)
+                VALUES (%s, %s, %s, %s, %s, %s, POINT(0,0), NOW())
+            """, (str, str, str, int, str, str))
+
+UPDATE_CUSTOMER = query('update_customer', """
+                UPDATE customer
+                SET first_name = %s, last_name = %s, email = %s, address_id = %s, last_update = NOW()
+                WHERE customer_id = %s
+            """, (str, str, str, int, int), sample=('MARY', 'SMITH', 'MARY.SMITH@sakilacustomer.org', 5, 1))
+
+CUSTOMER_EXISTS = query('customer_exists', "SELECT customer_id FROM sakila.customer WHERE customer_id = %s",
+                        (int,), sample=(1,))
+
+KNOWN_CUSTOMERS = query('known_customers', "SELECT customer_id FROM sakila.customer WHERE customer_id IN %s",
+                        (ids,), sample=([1, 2, 3],))
+
+# deleteCustomer runs as a background job that removes the history in chunks
+DELETE_PAYMENTS_CHUNK = query('delete_payments_chunk',
+                              "DELETE FROM sakila.payment WHERE customer_id = %s ORDER BY payment_id LIMIT %s",
+                              (int, int), sample=(1, 500))
+CUSTOMER_RENTALS_CHUNK = query('customer_rentals_chunk', """
+                    SELECT rental_id, inventory_id, return_date IS NULL AS open
+                    FROM sakila.rental
+                    WHERE customer_id = %s
+                    ORDER BY rental_id
+                    LIMIT %s
+                    FOR UPDATE
+                """, (int, int), sample=(1, 500))
+DELETE_RENTALS_BY_ID = query('delete_rentals_by_id', "DELETE FROM sakila.rental WHERE rental_id IN %s",
+                             (ids,), sample=([1, 2, 3],))
+DELETE_CUSTOMER = query('delete_customer', "DELETE FROM sakila.customer WHERE customer_id = %s;",
+                        (int,), sample=(1,))
+
+# Customer details; CUSTOMER_DATA_BATCH fills in "IN %s" for several customers
+CUSTOMER_DATA_SELECT = """SELECT
+    c.customer_id,
+    c.first_name,
+    c.last_name,
+    c.email,
+    a.address,
+    a.address2,
+    a.district,
+    a.postal_code,
+    a.phone,
+    ci.city,
+    co.country,
+    c.create_date,
+    c.last_update,
+    COALESCE(crc.rented, 0) AS rented,
+    COALESCE(crc.renting, 0) AS renting
+FROM sakila.customer c
+JOIN sakila.address a ON c.address_id = a.address_id
+JOIN sakila.city ci ON a.city_id = ci.city_id
+JOIN sakila.country co ON ci.country_id = co.country_id
+LEFT JOIN sakila.customer_rental_counts crc ON c.customer_id = crc.customer_id
+WHERE c.customer_id %s;
+"""
+
+CUSTOMER_DATA = query('customer_data', CUSTOMER_DATA_SELECT % "= %s", (int,), sample=(1,))
+
+OLDEST_OPEN_RENTAL = query('oldest_open_rental', """SELECT r.rental_id, r.inventory_id, i.film_id
+    FROM sakila.rental r
+    JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
+    WHERE r.customer_id = %s
+    AND i.film_id = %s
+    AND r.return_date IS NULL
+    ORDER BY r.rental_date ASC
+    LIMIT 1
+    FOR UPDATE;
+    """, (int, int), sample=(1, 1))
+
+OPEN_RENTAL_BY_ID = query('open_rental_by_id', """SELECT r.rental_id, r.inventory_id, i.film_id
+    FROM sakila.rental r
+    JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
+    WHERE r.rental_id = %s
+    AND r.customer_id = %s
+    AND r.return_date IS NULL
+    FOR UPDATE;
+    """, (int, int), sample=(1, 1))
+
+RETURN_RENTAL = query('return_rental',
+                      "UPDATE sakila.rental SET return_date = NOW() WHERE rental_id = %s AND return_date IS NULL",
+                      (int,), sample=(1,))
+
+# Availability index
+
+INVENTORY_STATUS = query('inventory_status', """
+                SELECT i.inventory_id, i.film_id, r.inventory_id IS NOT NULL AS rented
+                FROM sakila.inventory i
+                LEFT JOIN (
+                    SELECT DISTINCT inventory_id FROM sakila.rental WHERE return_date IS NULL
+                ) r ON i.inventory_id = r.inventory_id
+            """, sample=())
+
+
+# Bulk endpoints
+
+EXISTING_EMAILS = query('existing_emails', "SELECT email FROM customer WHERE email IN %s",
+                        (strs,), sample=(['MARY.SMITH@sakilacustomer.org'],))
+
+INSERT_CUSTOMER = query('insert_customer', """
+                    INSERT INTO customer (store_id, first_name, last_name, email, address_id, active, create_date, last_update)
+                    VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
+                """, (int, str, str, str, int, int))
+
+INSERT_ADDRESSES = query('insert_addresses', """
+            INSERT INTO address (address, address2, district, city_id, postal_code, phone, location, last_update)
+            VALUES (%s, %s, %s, %s, %s, %s, POINT(0,0), NOW())
+        """, (str, str, str, int, str, str))
+
+OPEN_INVENTORY = query('open_inventory',
+                       "SELECT inventory_id FROM sakila.rental WHERE inventory_id IN %s AND return_date IS NULL",
+                       (ids,), sample=([1, 2, 3],))
+
+INSERT_RENTAL = query('insert_rental', """
+                        INSERT INTO sakila.rental (customer_id, inventory_id, rental_date, return_date, staff_id)
+                        VALUES (%s, %s, NOW(), NULL, 1)
+                    """, (int, int))
+
+OPEN_RENTALS_FOR_CUSTOMERS = query('open_rentals_for_customers', """
+                    SELECT r.rental_id, r.inventory_id, r.customer_id, i.film_id
+                    FROM sakila.rental r
+                    JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
+                    WHERE r.customer_id IN %s AND r.return_date IS NULL
+                    ORDER BY r.rental_date ASC
+                    FOR UPDATE
+                """, (ids,), sample=([1, 2, 3],))
+
+RETURN_RENTALS = query('return_rentals', "UPDATE sakila.rental SET return_date = NOW() WHERE rental_id IN %s",
+                       (ids,), sample=([1, 2, 3],))
+
+# Batch detail endpoints
+
+FILM_DETAILS_BATCH = query('film_details_batch', """SELECT * FROM sakila.film WHERE film_id IN %s;""",
+                           (ids,), sample=([1, 2, 3],))
+
+FILM_DATA_BATCH = query('film_data_batch', FILM_DATA_SELECT % "IN %s", (ids,), sample=([1, 2, 3],))
+
+# Same shape as ACTOR_DETAILS, with the top 5 films ranked per actor
+ACTOR_DETAILS_BATCH = query('actor_details_batch', """
+                WITH actor_details AS (
+                    SELECT actor_id, first_name, last_name, last_update
+                    FROM sakila.actor
+                    WHERE actor_id IN %s
+                ),
+                film_rentals AS (
+                    SELECT afrc.actor_id, f.film_id, f.title, afrc.rentals AS rental_count
+                    FROM sakila.actor_film_rental_counts afrc
+                    JOIN sakila.film f ON afrc.film_id = f.film_id
+                    WHERE afrc.actor_id IN %s AND afrc.rentals > 0
+                ),
+                top_rented_movies AS (
+                    SELECT actor_id, film_id, title, rental_count,
+                        ROW_NUMBER() OVER (PARTITION BY actor_id ORDER BY rental_count DESC) AS rn
+                    FROM film_rentals
+                )
+                SELECT
+                    a.actor_id, a.first_name, a.last_name, a.last_update,
+                    m.film_id, m.title, m.rental_count
+                FROM actor_details a
+                LEFT JOIN top_rented_movies m ON m.actor_id = a.actor_id AND m.rn <= 5
+                ORDER BY a.actor_id, m.rental_count DESC;
+                """, (ids, ids), sample=([1, 2, 3], [1, 2, 3]))
+
+CUSTOMER_DATA_BATCH = query('customer_data_batch', CUSTOMER_DATA_SELECT % "IN %s", (ids,),
+                            sample=([1, 2, 3],))
+
+
+# Plan self-check
+
+def check_plans(db, max_rows=1000):
+    # EXPLAINs every statement that has sample arguments and flags full table
+    # scans over max_rows. Returns {query name: [warning, ...]} for the ones
+    # that regressed, so a missing index shows up at startup.
+    cursor = db.cursor()
+    problems = {}
+    try:
+        for q in CATALOG.values():
+            if q.sample is None:
+                continue
+            try:
+                cursor.execute("EXPLAIN " + q.sql.strip().rstrip(';'), q.bind(q.sample))
+                q.plan = cursor.fetchall()
+            except Exception as e:
+                q.plan = None
+                q.warnings = ['EXPLAIN failed: %s' % e]
+                problems[q.name] = q.warnings
+                continue
+            q.warnings = ['full scan of %s (%s rows)' % (row['table'], row['rows'])
+                          for row in q.plan
+                          if row.get('type') == 'ALL' and (row.get('rows') or 0) > max_rows]
+            if q.warnings:
+                problems[q.name] = q.warnings
+    finally:
+        db.rollback()
+        cursor.close()
+    return problems
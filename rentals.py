@@ -0,0 +1,128 @@
+import logging
+
+import queries
+import stats
+
+# Attempts before giving up on a film whose free copies keep turning out to be taken
+MAX_ATTEMPTS = 5
+
+log = logging.getLogger('sakila.rentals')
+
+
+def allocate(db, customer_id, film_id, attempts=MAX_ATTEMPTS):
+    # Rents one copy of film_id to customer_id and commits.
+    # Returns (rental_id, inventory_id), or None when every copy is out or
+    # locked by another allocation in flight.
+    #
+    # CLAIM_INVENTORY row-locks the chosen inventory row with SKIP LOCKED, so
+    # concurrent rentals of the same film spread over its free copies instead
+    # of queueing on one row, and nothing waits on a lock long enough to
+    # deadlock. The transaction runs in READ COMMITTED: once the lock is held,
+    # RENT_INVENTORY's NOT EXISTS guard is a fresh read that sees a rental
+    # committed by the previous holder of that copy. If the guard finds one,
+    # the claim was stale and the next copy is tried.
+    #
+    # Must be called with no transaction open on db.
+    customer_id = int(customer_id)
+    film_id = int(film_id)
+    cursor = db.cursor()
+    try:
+        for _ in range(attempts):
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+            db.begin()
+            queries.CLAIM_INVENTORY.run(cursor, film_id, 1)
+            row = cursor.fetchone()
+            if row is None:
+                db.rollback()
+                return None
+            inventory_id = row['inventory_id']
+            queries.RENT_INVENTORY.run(cursor, customer_id, inventory_id, inventory_id)
+            if cursor.rowcount == 0:
+                db.rollback()
+                continue
+            rental_id = cursor.lastrowid
+            db.commit()
+            record(db, [(customer_id, film_id)])
+            return rental_id, inventory_id
+        return None
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def allocate_many(db, rentals, attempts=MAX_ATTEMPTS):
+    # Rents a copy for each (customer_id, film_id) in one transaction and
+    # commits. Returns the inventory_id rented for each entry, None where the
+    # film had no free copy.
+    #
+    # Same protocol as allocate(), batched per film: one CLAIM_INVENTORY locks
+    # as many copies as the film was asked for, the copies a rental committed
+    # to in the meantime are dropped, and the rest are inserted at once. Our
+    # own inserts are visible to the next round's NOT EXISTS, so a retry never
+    # picks a copy this batch already rented.
+    #
+    # Must be called with no transaction open on db.
+    rentals = [(int(customer_id), int(film_id)) for customer_id, film_id in rentals]
+    rented = [None] * len(rentals)
+    wanted = {}
+    for i, (_, film_id) in enumerate(rentals):
+        wanted.setdefault(film_id, []).append(i)
+
+    cursor = db.cursor()
+    try:
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        db.begin()
+        for _ in range(attempts):
+            if not wanted:
+                break
+            claims = {}
+            for film_id, indexes in wanted.items():
+                queries.CLAIM_INVENTORY.run(cursor, film_id, len(indexes))
+                for i, row in zip(indexes, cursor.fetchall()):
+                    claims[i] = row['inventory_id']
+
+            retry = set()
+            if claims:
+                queries.OPEN_INVENTORY.run(cursor, list(claims.values()))
+                taken = {row['inventory_id'] for row in cursor.fetchall()}
+                retry = {i for i, inventory_id in claims.items() if inventory_id in taken}
+                fresh = [(i, inventory_id) for i, inventory_id in claims.items() if i not in retry]
+                if fresh:
+                    queries.INSERT_RENTAL.run_many(cursor, [(rentals[i][0], inventory_id)
+                                                            for i, inventory_id in fresh])
+                    for i, inventory_id in fresh:
+                        rented[i] = inventory_id
+
+            # Entries without a claim this round are out of stock
+            wanted = {film_id: [i for i in indexes if i in retry]
+                      for film_id, indexes in wanted.items()}
+            wanted = {film_id: indexes for film_id, indexes in wanted.items() if indexes}
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    record(db, [rentals[i] for i, inventory_id in enumerate(rented) if inventory_id is not None])
+    return rented
+
+
+def record(db, rentals):
+    # Adds committed rentals to the summary tables in a short transaction of
+    # their own, so the film and actor counter rows are never locked while an
+    # allocation is in flight. A failure here leaves the counts short until
+    # the next `flask rebuild-stats`; the rentals themselves stand.
+    if not rentals:
+        return
+    cursor = db.cursor()
+    try:
+        stats.record_rentals(cursor, rentals)
+        db.commit()
+    except Exception:
+        db.rollback()
+        log.exception("rental counts not updated for %d rentals", len(rentals))
+    finally:
+        cursor.close()
@@ -0,0 +1,96 @@
+import itertools
+import threading
+import time
+
+import pymysql
+
+
+class ReplicaRouter:
+    # Picks a replica pool for read-only requests. A background thread checks
+    # every replica each check_interval seconds; one that is unreachable, not
+    # replicating, or more than max_lag seconds behind is skipped until it
+    # recovers. With no healthy replica choose() returns None and the caller
+    # reads from the primary.
+    def __init__(self, pools, max_lag=5, check_interval=2):
+        # pools: [(name, ConnectionPool)]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.replicas = [{'name': name, 'pool': pool, 'healthy': False, 'lag': None, 'error': None,
+                          'checked_at': None} for name, pool in pools]
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+        self._thread = None
+
+    def ensure_started(self):
+        if self._thread is not None or not self.replicas:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._check_loop, daemon=True)
+        self.check_all()
+        self._thread.start()
+
+    def _check_loop(self):
+        while True:
+            time.sleep(self.check_interval)
+            self.check_all()
+
+    def check_all(self):
+        for replica in self.replicas:
+            self.check(replica)
+
+    def check(self, replica):
+        lag, error = None, None
+        try:
+            lag = self._lag(replica['pool'])
+            if lag is None:
+                error = 'replication is not running'
+            elif lag > self.max_lag:
+                error = 'lagging %ss' % lag
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        with self._lock:
+            replica['lag'] = lag
+            replica['error'] = error
+            replica['healthy'] = error is None
+            replica['checked_at'] = time.time()
+
+    def _lag(self, pool):
+        # Seconds_Behind_Source, None when the server isn't a running replica
+        db = pool.acquire()
+        cursor = db.cursor()
+        try:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except pymysql.err.ProgrammingError:
+                # MySQL before 8.0.22 and MariaDB
+                cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+            db.close()
+        if not row:
+            return None
+        lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+        return None if lag is None else int(lag)
+
+    def choose(self):
+        # Round robin over the healthy replicas
+        self.ensure_started()
+        with self._lock:
+            healthy = [r for r in self.replicas if r['healthy']]
+            if not healthy:
+                return None
+            return healthy[next(self._next) % len(healthy)]
+
+    def mark_down(self, replica, error):
+        # Taken out of rotation until the next successful check
+        with self._lock:
+            replica['healthy'] = False
+            replica['error'] = str(error) or type(error).__name__
+
+    def stats(self):
+        with self._lock:
+            return [{'name': r['name'], 'healthy': r['healthy'], 'lag': r['lag'], 'error': r['error'],
+                     'checked_at': r['checked_at'], 'pool': r['pool'].stats()} for r in self.replicas]
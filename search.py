@@ -0,0 +1,270 @@
+import bisect
+import logging
+import math
+import re
+import threading
+import time
+from datetime import timedelta
+
+import queries
+
+# Relevance weight of a term by the field it appears in
+FIELD_WEIGHTS = {'title': 3.0, 'actors': 2.0, 'categories': 2.0, 'description': 1.0}
+
+# How much a query term counts when it matched exactly, as a prefix, or with one typo
+EXACT, PREFIX, TYPO = 1.0, 0.6, 0.4
+
+_token = re.compile(r'[a-z0-9]+')
+
+log = logging.getLogger('sakila.search')
+
+
+def tokenize(text):
+    return _token.findall(text.lower()) if text else []
+
+
+def _deletes(term):
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _one_edit(a, b):
+    # True when a and b differ by one insertion, deletion, substitution or
+    # swap of neighbouring letters
+    if abs(len(a) - len(b)) > 1 or a == b:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1
+                                  and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class FilmSearch:
+    # In-memory inverted index over film titles, descriptions, actor names and
+    # category names. Built with one query, then kept current by re-indexing
+    # the films whose rows (or whose actors/categories) have a newer
+    # last_update than the previous refresh. Deleted film_actor/film_category
+    # rows don't move any last_update, the periodic full rebuild picks those up.
+    def __init__(self, connect, refresh_interval=30, rebuild_interval=3600, overlap=60):
+        self._connect = connect
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.overlap = overlap
+        self._lock = threading.Lock()
+        # Serialises the first load, so concurrent cold requests wait for one
+        self._load_lock = threading.Lock()
+        self._postings = {}
+        self._docs = {}
+        self._vocabulary = []
+        self._typo_index = {}
+        self._dirty = False
+        self._loaded = False
+        self._thread = None
+        self._watermark = None
+        self._version = 0
+        self._changed_at = 0
+        self.last_refresh = None
+        self.last_rebuild = None
+
+    def _fetch(self, cursor, film_ids=None):
+        if film_ids is None:
+            queries.SEARCH_DOCUMENTS.run(cursor)
+        else:
+            queries.SEARCH_DOCUMENTS_FOR.run(cursor, film_ids)
+        docs = {}
+        for row in cursor.fetchall():
+            docs[row['film_id']] = {
+                'title': tokenize(row['title']),
+                'description': tokenize(row['description']),
+                'actors': tokenize((row['actors'] or '').replace('|', ' ')),
+                'categories': tokenize((row['categories'] or '').replace('|', ' ')),
+            }
+        return docs
+
+    def _db_now(self, cursor):
+        queries.DB_NOW.run(cursor)
+        return cursor.fetchone()['now']
+
+    def rebuild(self):
+        db = self._connect()
+        cursor = db.cursor()
+        try:
+            watermark = self._db_now(cursor)
+            docs = self._fetch(cursor)
+        finally:
+            cursor.close()
+            db.close()
+
+        postings = {}
+        for film_id, fields in docs.items():
+            self._add(postings, film_id, fields)
+        with self._lock:
+            self._postings = postings
+            self._docs = docs
+            self._dirty = True
+            self._watermark = watermark
+            self._loaded = True
+            self.last_refresh = self.last_rebuild = time.time()
+            self._version += 1
+            self._changed_at = self.last_refresh
+
+    def refresh(self):
+        # Re-indexes films changed since the watermark. The overlap re-reads a
+        # little history so a transaction that committed late isn't missed.
+        if not self._loaded:
+            return self.rebuild()
+        db = self._connect()
+        cursor = db.cursor()
+        try:
+            watermark = self._db_now(cursor)
+            since = self._watermark - timedelta(seconds=self.overlap)
+            queries.CHANGED_FILMS.run(cursor, since, since, since, since, since)
+            changed = [row['film_id'] for row in cursor.fetchall()]
+            docs = self._fetch(cursor, changed) if changed else {}
+        finally:
+            cursor.close()
+            db.close()
+
+        with self._lock:
+            for film_id in changed:
+                old = self._docs.pop(film_id, None)
+                if old is not None:
+                    self._remove(film_id, old)
+                if film_id in docs:
+                    self._docs[film_id] = docs[film_id]
+                    self._add(self._postings, film_id, docs[film_id])
+            self._watermark = watermark
+            self.last_refresh = time.time()
+            if changed:
+                self._dirty = True
+                self._version += 1
+                self._changed_at = self.last_refresh
+        return len(changed)
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            self.rebuild()
+            if self.refresh_interval and self._thread is None:
+                self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+                self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                if self.rebuild_interval and time.time() - self.last_rebuild > self.rebuild_interval:
+                    self.rebuild()
+                else:
+                    self.refresh()
+            except Exception:
+                log.exception("film search refresh failed")
+
+    @staticmethod
+    def _add(postings, film_id, fields):
+        for field, terms in fields.items():
+            for term in terms:
+                by_film = postings.setdefault(term, {})
+                counts = by_film.setdefault(film_id, {})
+                counts[field] = counts.get(field, 0) + 1
+
+    def _remove(self, film_id, fields):
+        for terms in fields.values():
+            for term in set(terms):
+                by_film = self._postings.get(term)
+                if by_film is None:
+                    continue
+                by_film.pop(film_id, None)
+                if not by_film:
+                    del self._postings[term]
+
+    def _refresh_vocabulary(self):
+        # Called with the lock held; sorted terms for prefix lookups and a
+        # delete-one-letter map for typo lookups
+        if not self._dirty:
+            return
+        self._vocabulary = sorted(self._postings)
+        typo_index = {}
+        for term in self._vocabulary:
+            if len(term) < 4:
+                continue
+            for variant in _deletes(term) | {term}:
+                typo_index.setdefault(variant, []).append(term)
+        self._typo_index = typo_index
+        self._dirty = False
+
+    def _expand(self, word):
+        # [(term, match factor)] for one query word
+        matches = {}
+        if word in self._postings:
+            matches[word] = EXACT
+        i = bisect.bisect_left(self._vocabulary, word)
+        while i < len(self._vocabulary) and self._vocabulary[i].startswith(word):
+            matches.setdefault(self._vocabulary[i], PREFIX)
+            i += 1
+        if len(word) >= 4:
+            for variant in _deletes(word) | {word}:
+                for term in self._typo_index.get(variant, ()):
+                    if term not in matches and _one_edit(word, term):
+                        matches[term] = TYPO
+        return matches.items()
+
+    def search(self, text, fields=None, after=None, limit=20):
+        # Returns ([(film_id, score)], has_more) ranked by score, then film_id.
+        # Every query word has to match (exactly, as a prefix or with one typo)
+        # in one of the fields. after is the (score, film_id) of the last row
+        # of the previous page.
+        self.ensure_loaded()
+        words = tokenize(text)
+        if not words:
+            return [], False
+        fields = fields or tuple(FIELD_WEIGHTS)
+        with self._lock:
+            self._refresh_vocabulary()
+            total = max(len(self._docs), 1)
+            scores = None
+            for word in words:
+                word_scores = {}
+                for term, factor in self._expand(word):
+                    by_film = self._postings[term]
+                    idf = math.log(1 + total / len(by_film))
+                    for film_id, counts in by_film.items():
+                        weight = sum(FIELD_WEIGHTS[f] * (1 + math.log(n)) for f, n in counts.items() if f in fields)
+                        if weight:
+                            score = weight * idf * factor
+                            if score > word_scores.get(film_id, 0):
+                                word_scores[film_id] = score
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {film_id: score + word_scores[film_id]
+                              for film_id, score in scores.items() if film_id in word_scores}
+                if not scores:
+                    return [], False
+
+        ranked = sorted(((round(score, 6), film_id) for film_id, score in scores.items()),
+                        key=lambda hit: (-hit[0], hit[1]))
+        if after is not None:
+            after_score, after_id = after
+            ranked = [hit for hit in ranked if (-hit[0], hit[1]) > (-after_score, after_id)]
+        return [(film_id, score) for score, film_id in ranked[:limit]], len(ranked) > limit
+
+    def version(self):
+        # (token, unix time) of the last change to the indexed documents
+        self.ensure_loaded()
+        with self._lock:
+            return 'search%d' % self._version, self._changed_at
+
+    def stats(self):
+        with self._lock:
+            return {'films': len(self._docs), 'terms': len(self._postings),
+                    'last_refresh': self.last_refresh, 'last_rebuild': self.last_rebuild,
+                    'watermark': self._watermark}
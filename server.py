@@ -1,52 +1,443 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, g, has_app_context
 from flask_cors import CORS
+import click
+import base64
+import functools
+import json
+import logging
+import time
 from datetime import datetime
 import pymysql
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from pool import ConnectionPool
+from cache import TTLCache
+from availability import AvailabilityIndex
+from geo_cache import GeoCache
+from replicas import ReplicaRouter
+from jobs import JobQueue
+from search import FilmSearch
+from admission import ConcurrencyGate, Overloaded, RateLimiter, retry_after
+import stats
+import queries
+import migrate
+import rentals
+import metrics
+import json_provider
+from json_provider import COLUMNAR_MIMETYPE, columnar
+from http_cache import TableVersions, conditional
 
 app = Flask(__name__)
-cors = CORS(app, origins='*')
+if json_provider.orjson is not None:
+    app.json = json_provider.OrjsonProvider(app)
+
+# Origins allowed to call the API from a browser; asgi.py applies the same list
+# to its async routes. Credentials are allowed so the frontend's fetches carry
+# the read-your-writes cookie (they need credentials: 'include'), which is why
+# the origins are listed rather than '*'.
+app.config['CORS_ORIGINS'] = ['http://localhost:3000', 'http://127.0.0.1:3000']
+app.config['CORS_SUPPORTS_CREDENTIALS'] = True
+cors = CORS(app)
 
 # Configuring MySQL Database connection
 app.config['MYSQL_HOST'] = 'localhost'
+app.config['MYSQL_PORT'] = 3306
 app.config['MYSQL_USER'] = 'root'
 app.config['MYSQL_PASSWORD'] = 'password'
 app.config['MYSQL_DB'] = 'sakila'
 
-def get_db():
-    return pymysql.connect(host=app.config['MYSQL_HOST'],
+# Connection pool settings (times are in seconds)
+app.config['MYSQL_POOL_SIZE'] = 10
+app.config['MYSQL_POOL_TIMEOUT'] = 10
+app.config['MYSQL_POOL_MAX_LIFETIME'] = 1800
+app.config['MYSQL_POOL_IDLE_TIMEOUT'] = 300
+app.config['MYSQL_POOL_PING_INTERVAL'] = 5
+
+# Read replicas as 'host:port' strings, e.g. ['localhost:3307']. Read-only routes
+# use a replica that is at most REPLICA_MAX_LAG seconds behind, and fall back
+# to the primary when none is. A client that just wrote reads from the primary
+# for READ_YOUR_WRITES_WINDOW seconds (tracked in a cookie).
+app.config['MYSQL_REPLICAS'] = []
+app.config['REPLICA_MAX_LAG'] = 5
+app.config['REPLICA_CHECK_INTERVAL'] = 2
+app.config['READ_YOUR_WRITES_WINDOW'] = 5
+
+# Admission control. Token buckets per client and route class as (requests per
+# second, burst); heavy reads and bulk writes also share HEAVY_CONCURRENCY slots
+# with a bounded wait queue. Over the limit the answer is 429 or 503 with Retry-After.
+# Clients are told apart by remote address. Behind reverse proxies set
+# PROXY_FIX_X_FOR to how many of them append to X-Forwarded-For, so the address
+# comes from the entry the outermost proxy added, not one the client sent.
+app.config['ADMISSION_ENABLED'] = True
+app.config['RATE_LIMITS'] = {'cheap': (50, 100), 'heavy': (5, 20), 'write': (10, 20), 'bulk': (1, 5)}
+app.config['RATE_LIMIT_CLIENTS'] = 10000
+app.config['GATED_ROUTE_CLASSES'] = ('heavy', 'bulk')
+app.config['HEAVY_CONCURRENCY'] = 4
+app.config['HEAVY_QUEUE_SIZE'] = 16
+app.config['HEAVY_QUEUE_TIMEOUT'] = 2
+app.config['PROXY_FIX_X_FOR'] = 0
+
+# Async (ASGI) mode settings, see asgi.py
+app.config['ASYNC_POOL_SIZE'] = 20
+app.config['QUERY_TIMEOUT'] = 5
+
+# Page size for the list endpoints
+app.config['PAGE_SIZE'] = 20
+app.config['MAX_PAGE_SIZE'] = 100
+app.config['MAX_BATCH_SIZE'] = 200
+
+# Rows written per transaction by the bulk endpoints
+app.config['BULK_CHUNK_SIZE'] = 500
+
+# Background jobs (customer deletion): worker threads per process, rows per
+# transaction and the pause between transactions (seconds)
+app.config['JOB_WORKERS'] = 2
+app.config['JOB_POLL_INTERVAL'] = 1
+app.config['JOB_STALE_AFTER'] = 300
+app.config['DELETE_CHUNK_SIZE'] = 500
+app.config['DELETE_CHUNK_PAUSE'] = 0.05
+# Times the final customer delete is retried when new payments or rentals keep
+# appearing, and the pause before each retry (seconds)
+app.config['DELETE_RETRIES'] = 5
+app.config['DELETE_RETRY_PAUSE'] = 1
+
+# Film search index: changed films are re-indexed every SEARCH_REFRESH_INTERVAL
+# seconds, the whole index is rebuilt every SEARCH_REBUILD_INTERVAL seconds
+app.config['SEARCH_REFRESH_INTERVAL'] = 30
+app.config['SEARCH_REBUILD_INTERVAL'] = 3600
+
+# How often the availability index is checked against MySQL (seconds)
+app.config['AVAILABILITY_RECONCILE_INTERVAL'] = 300
+
+# Statements slower than this are logged to the sakila.slow_query logger, None disables it
+app.config['SLOW_QUERY_MS'] = None
+
+# Conditional GET: rental/customer versions come from sakila.table_versions,
+# the hand-edited catalog tables are probed at most every HTTP_PROBE_INTERVAL seconds
+app.config['HTTP_PROBE_INTERVAL'] = 5
+app.config['HTTP_CACHE_MAX_AGE'] = 0
+
+# Leaderboard cache settings. Entries are keyed by the tables' version token, so
+# a write made through any worker is a miss everywhere.
+app.config['TOP_CACHE_TTL'] = 300
+app.config['TOP_CACHE_SIZE'] = 32
+
+# EXPLAIN every catalog query at startup and log full scans over QUERY_PLAN_MAX_ROWS rows
+app.config['QUERY_SELF_CHECK'] = False
+app.config['QUERY_PLAN_MAX_ROWS'] = 1000
+
+def connect_db(host=None, port=None):
+    return pymysql.connect(host=host or app.config['MYSQL_HOST'],
+                            port=port or app.config['MYSQL_PORT'],
                             user=app.config['MYSQL_USER'],
                             password=app.config['MYSQL_PASSWORD'],
                             db=app.config['MYSQL_DB'],
-                            cursorclass=pymysql.cursors.DictCursor)
+                            cursorclass=metrics.InstrumentedDictCursor)
+
+db_pool = ConnectionPool(connect_db,
+                         max_size=app.config['MYSQL_POOL_SIZE'],
+                         max_lifetime=app.config['MYSQL_POOL_MAX_LIFETIME'],
+                         idle_timeout=app.config['MYSQL_POOL_IDLE_TIMEOUT'],
+                         acquire_timeout=app.config['MYSQL_POOL_TIMEOUT'],
+                         ping_interval=app.config['MYSQL_POOL_PING_INTERVAL'])
+
+def replica_pool(address):
+    host, _, port = address.partition(':')
+    return ConnectionPool(lambda: connect_db(host, int(port or 3306)),
+                          max_size=app.config['MYSQL_POOL_SIZE'],
+                          max_lifetime=app.config['MYSQL_POOL_MAX_LIFETIME'],
+                          idle_timeout=app.config['MYSQL_POOL_IDLE_TIMEOUT'],
+                          acquire_timeout=app.config['MYSQL_POOL_TIMEOUT'],
+                          ping_interval=app.config['MYSQL_POOL_PING_INTERVAL'])
+
+replicas = ReplicaRouter([(address, replica_pool(address)) for address in app.config['MYSQL_REPLICAS']],
+                         max_lag=app.config['REPLICA_MAX_LAG'],
+                         check_interval=app.config['REPLICA_CHECK_INTERVAL'])
+
+if app.config['PROXY_FIX_X_FOR']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+rate_limiter = RateLimiter(app.config['RATE_LIMITS'], max_clients=app.config['RATE_LIMIT_CLIENTS'])
+heavy_gate = ConcurrencyGate(app.config['HEAVY_CONCURRENCY'],
+                             queue_size=app.config['HEAVY_QUEUE_SIZE'],
+                             timeout=app.config['HEAVY_QUEUE_TIMEOUT'])
+
+# Cache for the landing page leaderboards, cleared whenever rentals change
+top_cache = TTLCache(ttl=app.config['TOP_CACHE_TTL'], max_size=app.config['TOP_CACHE_SIZE'])
+
+# Free copies per film, loaded on first use and updated by rentFilm/returnFilm
+availability = AvailabilityIndex(db_pool.acquire,
+                                 reconcile_interval=app.config['AVAILABILITY_RECONCILE_INTERVAL'])
+
+# Country/city ids for customer add/update
+geo_cache = GeoCache(db_pool.acquire)
+
+# Title/description/actor/genre search for the Films page
+film_search = FilmSearch(db_pool.acquire,
+                         refresh_interval=app.config['SEARCH_REFRESH_INTERVAL'],
+                         rebuild_interval=app.config['SEARCH_REBUILD_INTERVAL'])
+
+# Long-running maintenance work, see jobs.py
+job_queue = JobQueue(db_pool.acquire,
+                     workers=app.config['JOB_WORKERS'],
+                     poll_interval=app.config['JOB_POLL_INTERVAL'],
+                     stale_after=app.config['JOB_STALE_AFTER'])
+
+def get_db():
+    # Outside of a request (startup, CLI) the caller owns the connection and must close() it
+    if not has_app_context():
+        return db_pool.acquire()
+    db = g.get('db')
+    if db is None or db.released:
+        start = time.perf_counter()
+        db = g.db = acquire_for_request()
+        metrics.db_acquire.observe(time.perf_counter() - start)
+    return db
+
+def read_replica():
+    # Routes marked @replica_read go to a healthy replica unless the client
+    # wrote recently or, for @cached_get routes, one of their tables changed
+    # within the lag allowance (the ETag must not label a pre-write body).
+    if g.get('read_only') and not wrote_recently() and not tables_changed_recently():
+        return replicas.choose()
+    return None
+
+def acquire_for_request():
+    replica = read_replica()
+    if replica is not None:
+        try:
+            return replica['pool'].acquire()
+        except Exception as e:
+            replicas.mark_down(replica, e)
+    return db_pool.acquire()
+
+def read_pool():
+    # For generators that outlive the request and borrow their own connection
+    replica = read_replica()
+    return replica['pool'] if replica is not None else db_pool
+
+def replica_read(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    wrapper.read_only = True
+    return wrapper
+
+# Admission class of a route: 'heavy', 'bulk', or 'exempt' for monitoring.
+# Unmarked routes are 'cheap' when they only read and 'write' otherwise.
+def route_class(name):
+    def decorator(view):
+        view.route_class = name
+        return view
+    return decorator
+
+WRITE_COOKIE = 'sakila_primary_until'
+
+def wrote_recently():
+    until = request.cookies.get(WRITE_COOKIE, type=float)
+    return until is not None and until > time.time()
+
+def tables_changed_recently():
+    tables = g.get('read_tables')
+    if not tables:
+        return False
+    written = table_versions.last_write(tables)
+    return written is not None and time.time() - written < app.config['REPLICA_MAX_LAG']
+
+# Version tokens behind the ETag/Last-Modified headers of the read endpoints.
+# The catalog tables (film, actor, category, ...) are never written by the app,
+# so they are probed.
+table_versions = TableVersions(get_db, db_pool.acquire, tracked=('rental', 'customer'),
+                               probe_interval=app.config['HTTP_PROBE_INTERVAL'])
+
+def cached_get(*tables, extra=None):
+    def decorator(view):
+        cached = conditional(table_versions, tables, max_age=app.config['HTTP_CACHE_MAX_AGE'],
+                             extra=extra)(view)
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g.read_tables = tables
+            return cached(*args, **kwargs)
+        return wrapper
+    return decorator
+
+if app.config['SLOW_QUERY_MS'] is not None:
+    metrics.slow_query_threshold = app.config['SLOW_QUERY_MS'] / 1000.0
+    logging.getLogger('sakila.slow_query').setLevel(logging.WARNING)
+
+# Per-route latency and response size
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.request_latency.observe(time.perf_counter() - start, request.method, route, response.status_code)
+        if not response.is_streamed:
+            metrics.response_size.observe(response.calculate_content_length() or 0, request.method, route)
+    return response
+
+def classify_request():
+    view = app.view_functions.get(request.endpoint)
+    name = getattr(view, 'route_class', None)
+    if name:
+        return name
+    return 'cheap' if request.method == 'GET' or getattr(view, 'read_only', False) else 'write'
+
+def client_id():
+    return request.remote_addr or 'unknown'
+
+def too_busy(status, message, seconds):
+    response = jsonify({'message': message})
+    response.status_code = status
+    response.headers['Retry-After'] = retry_after(seconds)
+    return response
+
+# Turn requests away before they reach MySQL: over the client's rate, or no
+# heavy slot free within HEAVY_QUEUE_TIMEOUT
+@app.before_request
+def admit():
+    if not app.config['ADMISSION_ENABLED'] or request.method == 'OPTIONS':
+        return None
+    name = classify_request()
+    wait = rate_limiter.take(client_id(), name)
+    if wait:
+        metrics.admission_rejections.inc(1, name, 'rate_limited')
+        return too_busy(429, 'Rate limit exceeded', wait)
+    if name in app.config['GATED_ROUTE_CLASSES']:
+        try:
+            heavy_gate.enter()
+        except Overloaded:
+            metrics.admission_rejections.inc(1, name, 'overloaded')
+            return too_busy(503, 'Server busy', app.config['HEAVY_QUEUE_TIMEOUT'])
+        g.gate_held = True
+    return None
+
+# A streamed body keeps its heavy slot until the last row is sent
+@app.after_request
+def release_gate_on_close(response):
+    if g.pop('gate_held', False):
+        response.call_on_close(heavy_gate.exit)
+    return response
+
+@app.teardown_request
+def release_gate(exception):
+    if g.pop('gate_held', False):
+        heavy_gate.exit()
+
+# Read-your-writes: after a successful write the client reads from the primary for a while
+@app.after_request
+def stick_to_primary(response):
+    window = app.config['READ_YOUR_WRITES_WINDOW']
+    if (replicas.replicas and window and request.method not in ('GET', 'HEAD', 'OPTIONS')
+            and not g.get('read_only') and response.status_code < 400):
+        response.set_cookie(WRITE_COOKIE, '%.3f' % (time.time() + window), max_age=window,
+                            httponly=True, samesite='Lax')
+    return response
+
+# Hands the connection back to the pool even when a handler returned early
+@app.teardown_appcontext
+def release_db(exception):
+    db = g.pop('db', None)
+    if db is not None and not db.released:
+        db.close(discard=exception is not None)
+
+# Keyset pagination helpers: the cursor is the sort key of the last row sent
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(token, size):
+    if not token:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != size:
+        raise ValueError("Invalid cursor")
+    return key
+
+# List endpoints can answer in columnar form: ?format=columnar or an Accept header
+def wants_columnar():
+    return request.args.get('format') == 'columnar' or request.accept_mimetypes.best == COLUMNAR_MIMETYPE
+
+def list_response(key, rows, columns, **extra):
+    if not wants_columnar():
+        return jsonify({key: rows, **extra})
+    response = jsonify({**columnar(rows, columns), **extra})
+    response.mimetype = COLUMNAR_MIMETYPE
+    return response
+
+def page_limit():
+    limit = request.args.get('limit', app.config['PAGE_SIZE'], type=int)
+    return max(1, min(limit, app.config['MAX_PAGE_SIZE']))
 
 @app.route('/', methods=['GET'])
 def index():
     return "home"
 
+@app.route('/pool/stats', methods=['GET'])
+@route_class('exempt')
+def pool_stats():
+    pools = db_pool.stats()
+    if replicas.replicas:
+        pools['replicas'] = replicas.stats()
+    return jsonify(pools)
+
+@app.route('/metrics', methods=['GET'])
+@route_class('exempt')
+def prometheus_metrics():
+    lines = [metrics.render()]
+    pool = db_pool.stats()
+    lines.append('# TYPE db_pool_connections gauge\n')
+    lines.append('db_pool_connections{state="in_use"} %d\n' % pool['in_use'])
+    lines.append('db_pool_connections{state="idle"} %d\n' % pool['idle'])
+    gate = heavy_gate.stats()
+    lines.append('# TYPE admission_heavy_requests gauge\n')
+    lines.append('admission_heavy_requests{state="active"} %d\n' % gate['active'])
+    lines.append('admission_heavy_requests{state="waiting"} %d\n' % gate['waiting'])
+    cache = top_cache.stats()
+    lines.append('# TYPE cache_lookups_total counter\n')
+    lines.append('cache_lookups_total{result="hit"} %d\n' % cache['hits'])
+    lines.append('cache_lookups_total{result="miss"} %d\n' % cache['misses'])
+    return Response(''.join(lines), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats', methods=['GET'])
+@route_class('exempt')
+def cache_stats():
+    return jsonify(top_cache.stats())
+
+@app.route('/queries', methods=['GET'])
+@route_class('exempt')
+def query_catalog():
+    # Plans are filled in by the self-check (QUERY_SELF_CHECK or flask check-queries)
+    return jsonify([{'name': q.name, 'plan': q.plan, 'warnings': q.warnings}
+                    for q in queries.CATALOG.values()])
+
 
 # Landing Page Feature 1
 # As a user I want to view top 5 rented films of all times
 @app.route("/top/rented_films", methods=['GET'])
+@cached_get('rental')
 def top5films():
+    return jsonify(top_cache.get_or_load(('top5films', g.version_token), load_top5films))
+
+def load_top5films():
     db = get_db()
     cursor = db.cursor()
-    sql_query = """SELECT f.film_id, f.title, c.name AS category_name, 
-                    COUNT(r.rental_id) AS rented FROM sakila.film f 
-                    JOIN sakila.inventory i ON f.film_id = i.film_id 
-                    JOIN sakila.rental r ON i.inventory_id = r.inventory_id 
-                    JOIN sakila.film_category fc ON f.film_id = fc.film_id 
-                    JOIN sakila.category c ON fc.category_id = c.category_id 
-                    GROUP BY f.film_id, f.title, c.name 
-                    ORDER BY rented DESC LIMIT 5;"""
-    cursor.execute(sql_query)
+    queries.TOP_FILMS.run(cursor)
     results = cursor.fetchall()
     cursor.close()
     db.close()
-    return jsonify(results)
+    return results
 
 # Landing Page Feature 2
 # As a user I want to be able to click on any of the top 5 films and view its details
 @app.route("/details/top5films", methods=['POST'])
+@replica_read
 def film_details():
     db = get_db()
     cursor = db.cursor()
@@ -55,8 +446,7 @@ def film_details():
     data = request.get_json()
     film_id = data['film_id']
 
-    sql_query = """SELECT * FROM sakila.film WHERE film_id = %s;"""
-    cursor.execute(sql_query, (film_id))
+    queries.FILM_DETAILS.run(cursor, film_id)
     results = cursor.fetchall()
     cursor.close()
     db.close()
@@ -66,22 +456,21 @@ def film_details():
 # Landing Page Feature 3
 # As a user I want to be able to view top 5 actors that are part of films I have in the store
 @app.route("/top/actors", methods=['GET'])
+@cached_get('rental', 'film_actor')
 def top5actors():
+    return jsonify(top_cache.get_or_load(('top5actors', g.version_token), load_top5actors))
+
+def load_top5actors():
     db = get_db()
     cursor = db.cursor()
-    sql_query = """SELECT actor.actor_id, actor.first_name, actor.last_name, 
-                    COUNT(film_actor.film_id) AS movies 
-                    FROM sakila.actor 
-                    JOIN sakila.film_actor on actor.actor_id = film_actor.actor_id 
-                    GROUP BY actor.actor_id 
-                    ORDER BY movies DESC LIMIT 5;"""
-    cursor.execute(sql_query)
+    queries.TOP_ACTORS.run(cursor)
     results = cursor.fetchall()
     cursor.close()
     db.close()
-    return jsonify(results)
+    return results
 
 @app.route("/details/top5actors", methods=['POST'])
+@replica_read
 def actor_details():
     db = get_db()
     cursor = db.cursor()
@@ -89,30 +478,7 @@ def actor_details():
     # Getting data film_id
     data = request.get_json()
     actor_id = data['actor_id']
-    sql_query = """
-                WITH actor_details AS (
-                    SELECT actor_id, first_name, last_name, last_update
-                    FROM sakila.actor
-                    WHERE actor_id = %s
-                ),
-                top_rented_movies AS (
-                    SELECT f.film_id, f.title, COUNT(r.rental_id) AS rental_count
-                    FROM sakila.film f
-                    JOIN sakila.inventory i ON f.film_id = i.film_id
-                    JOIN sakila.rental r ON i.inventory_id = r.inventory_id
-                    JOIN sakila.film_actor fa ON f.film_id = fa.film_id
-                    WHERE fa.actor_id = %s
-                    GROUP BY f.film_id, f.title
-                    ORDER BY rental_count DESC
-                    LIMIT 5
-                )
-                SELECT 
-                    a.actor_id, a.first_name, a.last_name, a.last_update,
-                    m.film_id, m.title, m.rental_count
-                FROM actor_details a
-                LEFT JOIN top_rented_movies m ON 1=1;
-                """
-    cursor.execute(sql_query, (actor_id, actor_id))
+    queries.ACTOR_DETAILS.run(cursor, actor_id, actor_id)
     results = cursor.fetchall()
     cursor.close()
     db.close()
@@ -122,54 +488,113 @@ def actor_details():
 
 # Films Page Feature 1
 # As a user I want to be able to search a film by name of film, name of an actor, or genre of the film
+FILM_LIST_COLUMNS = ['film_id', 'title', 'release_year', 'genres', 'actors']
+
+# A search is answered from the index, which trails the tables by up to
+# SEARCH_REFRESH_INTERVAL, so its version is part of the ETag
+def search_version():
+    if not request.args.get('search', '').strip():
+        return None
+    return film_search.version()
+
 @app.route("/films", methods=['GET'])
+@route_class('heavy')
+@replica_read
+@cached_get('film', 'film_actor', 'actor', 'film_category', 'category', extra=search_version)
 def films():
+    # Getting query parameters
+    limit = page_limit()
+    search = request.args.get('search', '').strip()
+    filter_choice = request.args.get('filterChoice', '')
+    try:
+        after = decode_cursor(request.args.get('cursor'), 2)
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+
+    if search:
+        return search_films(search, filter_choice, after, limit)
+
+    where = []
+    params = []
+    if after:
+        where.append("(f.title > %s OR (f.title = %s AND f.film_id > %s))")
+        params.extend([after[0], after[0], after[1]])
+
     db = get_db()
     cursor = db.cursor()
 
-    # Getting data 
-    # data = request.get_json()
-    # limit = data.get('limit', 10)
-    # page = data.get('page', 1) - 1
-    # search = data.get('search', '').strip().lower()
-    # filter_choice = data.get('filterChoice', '')
-
-    # sql_query = """SELECT f.film_id, f.title, f.release_year,
-    #                 GROUP_CONCAT(DISTINCT c.name ORDER BY c.name SEPARATOR ', ') AS genres,
-    #                 GROUP_CONCAT(DISTINCT CONCAT(a.first_name, ' ', a.last_name) ORDER BY a.last_name SEPARATOR ', ') AS actors
-    #                 FROM sakila.film f
-    #                 JOIN sakila.film_actor fa ON f.film_id = fa.film_id
-    #                 JOIN sakila.actor a ON fa.actor_id = a.actor_id
-    #                 JOIN sakila.film_category fc ON f.film_id = fc.film_id
-    #                 JOIN sakila.category c ON fc.category_id = c.category_id
-    #                 WHERE 
-    #                     (%s = '' OR LOWER(f.title) LIKE CONCAT('%%', %s, '%%'))
-    #                     OR (%s = 'Actor' AND LOWER(CONCAT(a.first_name, ' ', a.last_name)) LIKE CONCAT('%%', %s, '%%'))
-    #                     OR (%s = 'Genre' AND LOWER(c.name) LIKE CONCAT('%%', %s, '%%'))
-    #                 GROUP BY f.film_id, f.title, f.release_year
-    #                 ORDER BY f.title
-    #                 LIMIT %s OFFSET %s"""
-    sql_query = """SELECT f.film_id, f.title, f.release_year,
-                    GROUP_CONCAT(DISTINCT c.name ORDER BY c.name SEPARATOR ', ') AS genres,
-                    GROUP_CONCAT(DISTINCT CONCAT(a.first_name, ' ', a.last_name) ORDER BY a.last_name SEPARATOR ', ') AS actors
-                    FROM sakila.film f
-                    JOIN sakila.film_actor fa ON f.film_id = fa.film_id
-                    JOIN sakila.actor a ON fa.actor_id = a.actor_id
-                    JOIN sakila.film_category fc ON f.film_id = fc.film_id
-                    JOIN sakila.category c ON fc.category_id = c.category_id
-                    GROUP BY f.film_id, f.title, f.release_year
-                    ORDER BY f.title"""
-    cursor.execute(sql_query)
-    # cursor.execute(sql_query, (search, search, filter_choice, search, filter_choice, search, limit, limit*page))
+    # Pick the page of film ids first, walking the title index from the cursor
+    sql_query = """SELECT f.film_id, f.title FROM sakila.film f
+                    %s
+                    ORDER BY f.title, f.film_id
+                    LIMIT %%s""" % ("WHERE " + " AND ".join(where) if where else "")
+    cursor.execute(sql_query, params + [limit + 1])
+    page = cursor.fetchall()
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor([page[-1]['title'], page[-1]['film_id']])
+
+    results = []
+    if page:
+        # Then aggregate actors and genres only for the films on this page
+        film_ids = [row['film_id'] for row in page]
+        queries.FILM_LIST_DETAILS.run(cursor, film_ids)
+        results = cursor.fetchall()
 
-    results = cursor.fetchall()
     cursor.close()
     db.close()
-    return jsonify(results)
+    return list_response('films', results, FILM_LIST_COLUMNS, next_cursor=next_cursor)
+
+# filterChoice values of the Films page and the index fields they search
+SEARCH_FIELDS = {'Title': ('title',), 'Actor': ('actors',), 'Genre': ('categories',)}
+
+def search_page(search, filter_choice, after, limit):
+    # Returns (film ids, next cursor) from the search index, ranked by relevance
+    if after is not None and not all(isinstance(v, (int, float)) for v in after):
+        raise ValueError("Invalid cursor")
+    hits, more = film_search.search(search, SEARCH_FIELDS.get(filter_choice), after, limit)
+    next_cursor = encode_cursor([hits[-1][1], hits[-1][0]]) if more else None
+    return [film_id for film_id, _ in hits], next_cursor
+
+def search_films(search, filter_choice, after, limit):
+    try:
+        film_ids, next_cursor = search_page(search, filter_choice, after, limit)
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+
+    results = []
+    if film_ids:
+        db = get_db()
+        cursor = db.cursor()
+        queries.FILM_LIST_DETAILS.run(cursor, film_ids)
+        by_id = {row['film_id']: row for row in cursor.fetchall()}
+        cursor.close()
+        db.close()
+        results = [by_id[film_id] for film_id in film_ids if film_id in by_id]
+    return list_response('films', results, FILM_LIST_COLUMNS, next_cursor=next_cursor)
+
+# Film ids only, straight from the index: no database round trip
+@app.route("/films/search", methods=['GET'])
+def film_search_ids():
+    search = request.args.get('q', '').strip()
+    try:
+        after = decode_cursor(request.args.get('cursor'), 2)
+        film_ids, next_cursor = search_page(search, request.args.get('filterChoice', ''), after, page_limit())
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+    return jsonify({'film_ids': film_ids, 'next_cursor': next_cursor})
+
+@app.route('/search/stats', methods=['GET'])
+@route_class('exempt')
+def search_stats():
+    return jsonify(film_search.stats())
 
 # Films Page Feature 2
 # As a user I want to be able to view details of the film
 @app.route("/details/filmdata", methods=['POST'])
+@replica_read
 def filmsData():
     db = get_db()
     cursor = db.cursor()
@@ -177,16 +602,7 @@ def filmsData():
     # Getting data film_id
     data = request.get_json()
     film_id = data['film_id']
-    sql_query = """SELECT f.title, f.film_id, f.description, f.release_year, f.rental_duration, f.rental_rate, f.length, f.replacement_cost, 
-                    f.rating, f.special_features,f.last_update,
-                    GROUP_CONCAT(DISTINCT CONCAT(a.first_name, ' ', a.last_name) ORDER BY a.last_name SEPARATOR ', ') AS actors
-                    FROM sakila.film f
-                    JOIN sakila.film_actor fa ON f.film_id = fa.film_id
-                    JOIN sakila.actor a ON fa.actor_id = a.actor_id
-                    WHERE f.film_id = %s
-                    GROUP BY f.title, f.film_id, f.description, f.release_year, f.rental_duration, f.rental_rate, 
-                            f.length, f.replacement_cost, f.rating, f.special_features, f.last_update"""
-    cursor.execute(sql_query, film_id)
+    queries.FILM_DATA.run(cursor, film_id)
     results = cursor.fetchall()
     cursor.close()
     db.close()
@@ -196,91 +612,159 @@ def filmsData():
 # As a user I want to be able to rent a film out to a customer
 @app.route("/rentFilm", methods=['POST'])
 def rentFilm():
-    # Get the database connection and cursor
     db = get_db()
-    cursor = db.cursor()
 
     # Getting data from the request
     data = request.get_json()
     customer_id = data['customer_id']
     film_id = data['film_id']
-    print(customer_id)
-    print(film_id)
-
-    # Prepare the SQL query to create a rental
-    sql_query = """
-    INSERT INTO sakila.rental (customer_id, inventory_id, rental_date, return_date, staff_id)
-    SELECT %s, i.inventory_id, NOW(), NULL, 1
-    FROM sakila.inventory i
-    WHERE i.film_id = %s
-    AND i.inventory_id NOT IN (
-        SELECT r.inventory_id 
-        FROM sakila.rental r
-        WHERE r.return_date IS NULL
-    )
-    ORDER BY i.inventory_id ASC
-    LIMIT 1;
-    """
-    
-    # Execute the query
-    cursor.execute(sql_query, (customer_id, film_id))
 
-    # Commit the transaction
-    db.commit()
-
-    # Close the cursor and connection
-    cursor.close()
+    allocation = rentals.allocate(db, customer_id, film_id)
     db.close()
 
+    if allocation is None:
+        return jsonify({"message": "Film not available"}), 409
+
+    rental_id, inventory_id = allocation
+    availability.mark_rented(inventory_id)
+    table_versions.bump('rental')
     # Return success response
-    return jsonify({"message": "Film rented"})
+    return jsonify({"message": "Film rented", "rental_id": rental_id, "inventory_id": inventory_id})
 
 # Films Page Feature 3
 # Check Film Availability
 @app.route('/checkFilmAvailability', methods=['POST'])
+@route_class('cheap')
+@replica_read
 def check_film_availability():
     data = request.get_json()
     film_id = data['film_id']
 
-    db = get_db()
-    cursor = db.cursor()
-
-    # Query to check available stock
-    sql_query = """
-        SELECT COUNT(*) AS available_stock 
-        FROM sakila.inventory 
-        WHERE film_id = %s AND inventory_id NOT IN (
-            SELECT inventory_id FROM sakila.rental WHERE return_date IS NULL
-        );
-    """
-    cursor.execute(sql_query, (film_id))
-    result = cursor.fetchone()
-
-    if result['available_stock'] > 0:
+    if availability.available(int(film_id)) > 0:
         return jsonify({'success': True})
     else:
         return jsonify({'success': False})
 
+# Availability for a whole page of films in one call, keyed by film_id
+@app.route('/checkFilmAvailability/batch', methods=['POST'])
+@route_class('cheap')
+@replica_read
+def check_film_availability_batch():
+    try:
+        film_ids = batch_ids('film_ids')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({'availability': availability.available_many(film_ids)})
+
 # Customers Page Feature 1
 # As a user I want to view a list of all customers (Pref. using pagination)
+CUSTOMER_FIELDS = ['customer_id', 'store_id', 'first_name', 'last_name', 'email',
+                   'address_id', 'active', 'create_date', 'last_update']
+
 @app.route("/customers", methods=['GET'])
+@route_class('heavy')
+@replica_read
+@cached_get('customer')
 def customers():
+    # Optional projection, customer_id is always sent since it is the cursor.
+    # Columns keep CUSTOMER_FIELDS order whatever order they were asked in.
+    fields = CUSTOMER_FIELDS
+    if request.args.get('fields'):
+        wanted = {f.strip() for f in request.args['fields'].split(',') if f.strip()}
+        unknown = sorted(wanted.difference(CUSTOMER_FIELDS))
+        if unknown:
+            return jsonify({'message': 'Unknown field: ' + ', '.join(unknown)}), 400
+        fields = [f for f in CUSTOMER_FIELDS if f in wanted or f == 'customer_id']
+
+    where = []
+    params = []
+    name = request.args.get('name', '').strip()
+    if name:
+        where.append("(first_name LIKE %s OR last_name LIKE %s OR CONCAT(first_name, ' ', last_name) LIKE %s)")
+        params.extend([name + '%'] * 3)
+    email = request.args.get('email', '').strip()
+    if email:
+        where.append("email LIKE %s")
+        params.append(email + '%')
+    active = request.args.get('active')
+    if active in ('0', '1'):
+        where.append("active = %s")
+        params.append(int(active))
+
+    # Full export: unbuffered cursor, rows are written out as they arrive
+    if request.args.get('stream') in ('1', 'true'):
+        sql_query = "SELECT %s FROM sakila.customer %s ORDER BY customer_id" % (
+            ", ".join(fields), "WHERE " + " AND ".join(where) if where else "")
+        if wants_columnar():
+            return Response(stream_customers(sql_query, params, fields, read_pool()), mimetype=COLUMNAR_MIMETYPE)
+        return Response(stream_customers(sql_query, params, pool=read_pool()), mimetype='application/json')
+
+    limit = page_limit()
+    try:
+        after = decode_cursor(request.args.get('cursor'), 1)
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+    if after:
+        where.append("customer_id > %s")
+        params.append(after[0])
+
+    sql_query = "SELECT %s FROM sakila.customer %s ORDER BY customer_id LIMIT %%s" % (
+        ", ".join(fields), "WHERE " + " AND ".join(where) if where else "")
+
     db = get_db()
     cursor = db.cursor()
-    sql_query = """SELECT * FROM sakila.customer;"""
-    cursor.execute(sql_query)
+    # The SQL varies with the fields and filters asked for, one metrics series for all of it
+    cursor.label = 'GET /customers'
+    cursor.execute(sql_query, params + [limit + 1])
     results = cursor.fetchall()
     cursor.close()
     db.close()
-    return jsonify(results)
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor([results[-1]['customer_id']])
+    return list_response('customers', results, fields, next_cursor=next_cursor)
+
+def stream_customers(sql_query, params, columns=None, pool=db_pool):
+    # Runs after the request has returned, so it borrows its own connection.
+    # With columns set, rows are sent as arrays after a single header.
+    db = pool.acquire()
+    cursor = db.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        cursor.execute(sql_query, params)
+        if columns:
+            yield '{"columns":' + app.json.dumps(columns) + ',"rows":['
+        else:
+            yield '['
+        first = True
+        for row in cursor:
+            if columns:
+                row = [row[c] for c in columns]
+            yield ('' if first else ',') + app.json.dumps(row)
+            first = False
+        yield ']}' if columns else ']'
+    finally:
+        cursor.close()
+        db.close()
+
+# MySQL error codes for a unique index violation (ER_DUP_ENTRY) and for
+# deleting a row a foreign key still points at (ER_ROW_IS_REFERENCED_2)
+DUPLICATE_KEY = 1062
+ROW_IS_REFERENCED = 1451
 
 # Customers Page Feature 3
 # As a user I want to be able to add a new customer
+def find_or_insert_address(cursor, address, address2, district, city_id, postal_code, phone):
+    # One round-trip when the address is new, a second lookup only when it already exists
+    queries.INSERT_ADDRESS_IF_NEW.run(cursor, address, address2, district, city_id, postal_code, phone, address, city_id)
+    if cursor.rowcount > 0:
+        return cursor.lastrowid
+    queries.ADDRESS_ID.run(cursor, address, city_id)
+    return cursor.fetchone()['address_id']
+
 @app.route("/customer/add", methods=['POST'])
 def add_customer():
-    db = get_db()
-    cursor = db.cursor()
-    
     # Get data from the request
     data = request.get_json()
 
@@ -298,51 +782,32 @@ def add_customer():
     if(first_name == '' or last_name == '' or email == '' or phone == '' or address == '' or district == '' or city == '' or postal_code == ''):
         return jsonify({'message': 'Field empty'})
 
-    # Check if email already exists
-    cursor.execute("SELECT email FROM customer WHERE email = %s", (email,))
-    if cursor.fetchone():
-        return jsonify({'message': 'Email already exists'})
-
-    # Check if the country exists
-    cursor.execute("SELECT country_id FROM country WHERE country = %s", (country,))
-    country_row = cursor.fetchone()
-    if country_row:
-        country_id = country_row['country_id']
-    else:
-        cursor.execute("INSERT INTO country (country, last_update) VALUES (%s, %s)", (country, datetime.utcnow()))
-        db.commit()
-        country_id = cursor.lastrowid
+    db = get_db()
+    cursor = db.cursor()
 
-    # Check if the city exists
-    cursor.execute("SELECT city_id FROM city WHERE city = %s AND country_id = %s", (city, country_id))
-    city_row = cursor.fetchone()
-    if city_row:
-        city_id = city_row['city_id']
-    else:
-        cursor.execute("INSERT INTO city (city, country_id, last_update) VALUES (%s, %s, %s)", (city, country_id, datetime.utcnow()))
-        db.commit()
-        city_id = cursor.lastrowid
+    # Everything below is one transaction, a duplicate email rolls back the address too
+    try:
+        city_id, pending = geo_cache.resolve(cursor, country, city)
+        address_id = find_or_insert_address(cursor, address, address2, district, city_id, postal_code, phone)
 
-    # Check if the address exists
-    cursor.execute("SELECT address_id FROM address WHERE address = %s AND city_id = %s", (address, city_id))
-    address_row = cursor.fetchone()
-    if address_row:
-        address_id = address_row['address_id']
-    else:
-        cursor.execute("""
-            INSERT INTO address (address, address2, district, city_id, postal_code, phone, location, last_update) 
-            VALUES (%s, %s, %s, %s, %s, %s, POINT(0,0), NOW())
-        """, (address, address2, district, city_id, postal_code, phone))
+        # The email check is folded into the insert
+        queries.INSERT_CUSTOMER_IF_NEW_EMAIL.run(cursor, 1, first_name, last_name, email, address_id, 1, email)
+        if cursor.rowcount == 0:
+            db.rollback()
+            return jsonify({'message': 'Email already exists'})
         db.commit()
-        address_id = cursor.lastrowid
-
-    # Insert new customer
-    cursor.execute("""
-        INSERT INTO customer (store_id, first_name, last_name, email, address_id, active, create_date, last_update)
-        VALUES (%s, %s, %s, %s, %s, %s, NOW(), NOW())
-    """, (1, first_name, last_name, email, address_id, 1))
-    db.commit()
+    except pymysql.err.IntegrityError as e:
+        # A concurrent insert of the same email won the unique index
+        db.rollback()
+        if e.args[0] != DUPLICATE_KEY:
+            raise
+        return jsonify({'message': 'Email already exists'})
+    except Exception:
+        db.rollback()
+        raise
 
+    geo_cache.remember(pending)
+    table_versions.bump('customer')
     cursor.close()
     db.close()
 
@@ -352,9 +817,6 @@ def add_customer():
 # As a user I want to be able to edit a customer’s details
 @app.route("/customer/update", methods=['PUT'])
 def updateCustomer():
-    db = get_db()
-    cursor = db.cursor()
-    
     # Get data from the request
     data = request.get_json()
 
@@ -373,63 +835,49 @@ def updateCustomer():
     if(first_name == '' or last_name == '' or email == '' or phone == '' or address == '' or district == '' or city == '' or postal_code == ''):
         return jsonify({'message': 'Field empty'})
 
-    # Fetch the current customer data from the database
-    cursor.execute("SELECT email, address_id FROM customer WHERE customer_id = %s", (customer_id,))
-    customer = cursor.fetchone()
-
-    if not customer:
-        return jsonify({'message': 'Customer not found'}), 404
-    
-    current_email = customer['email']
-
-    if email != current_email:
-        cursor.execute("SELECT email FROM customer WHERE email = %s", (email,))
-        if cursor.fetchone():
-            return jsonify({'message': 'Email already exists'}), 400
+    db = get_db()
+    cursor = db.cursor()
 
-    cursor.execute("SELECT country_id FROM country WHERE country = %s", (country,))
-    country_row = cursor.fetchone()
-    if country_row:
-        country_id = country_row['country_id']
-    else:
-        cursor.execute("INSERT INTO country (country, last_update) VALUES (%s, %s)", (country, datetime.utcnow()))
+    try:
+        city_id, pending = geo_cache.resolve(cursor, country, city)
+
+        # Fetch the customer together with any existing row for the submitted address
+        queries.CUSTOMER_FOR_UPDATE.run(cursor, address, city_id, customer_id)
+        customer = cursor.fetchone()
+
+        if not customer:
+            db.rollback()
+            return jsonify({'message': 'Customer not found'}), 404
+
+        if email != customer['email']:
+            queries.EMAIL_EXISTS.run(cursor, email)
+            if cursor.fetchone():
+                db.rollback()
+                return jsonify({'message': 'Email already exists'}), 400
+
+        address_id = customer['match_address_id']
+        if address_id:
+            # Update the address and the customer record in a single statement
+            queries.UPDATE_CUSTOMER_AND_ADDRESS.run(cursor, address_id, address, address2, district, postal_code, phone,
+                                                    first_name, last_name, email, customer_id)
+        else:
+            queries.INSERT_ADDRESS.run(cursor, address, address2, district, city_id, postal_code, phone)
+            address_id = cursor.lastrowid
+
+            # Update the customer record
+            queries.UPDATE_CUSTOMER.run(cursor, first_name, last_name, email, address_id, customer_id)
         db.commit()
-        country_id = cursor.lastrowid
-
-    cursor.execute("SELECT city_id FROM city WHERE city = %s AND country_id = %s", (city, country_id))
-    city_row = cursor.fetchone()
-    if city_row:
-        city_id = city_row['city_id']
-    else:
-        cursor.execute("INSERT INTO city (city, country_id, last_update) VALUES (%s, %s, %s)", (city, country_id, datetime.utcnow()))
-        db.commit()
-        city_id = cursor.lastrowid
-
-    cursor.execute("SELECT address_id FROM address WHERE address = %s AND city_id = %s", (address, city_id))
-    address_row = cursor.fetchone()
-    if address_row:
-        address_id = address_row['address_id']
-        cursor.execute("""
-            UPDATE address
-            SET address = %s, address2 = %s, district = %s, postal_code = %s, phone = %s, last_update = NOW()
-            WHERE address_id = %s
-        """, (address, address2, district, postal_code, phone, address_id))
-    else:
-        cursor.execute("""
-            INSERT INTO address (address, address2, district, city_id, postal_code, phone, location, last_update) 
-            VALUES (%s, %s, %s, %s, %s, %s, POINT(0,0), NOW())
-        """, (address, address2, district, city_id, postal_code, phone))
-        db.commit()
-        address_id = cursor.lastrowid
-
-    # Update the customer record
-    cursor.execute("""
-        UPDATE customer 
-        SET first_name = %s, last_name = %s, email = %s, address_id = %s, last_update = NOW() 
-        WHERE customer_id = %s
-    """, (first_name, last_name, email, address_id, customer_id))
-    db.commit()
-
+    except pymysql.err.IntegrityError as e:
+        db.rollback()
+        if e.args[0] != DUPLICATE_KEY:
+            raise
+        return jsonify({'message': 'Email already exists'}), 400
+    except Exception:
+        db.rollback()
+        raise
+
+    geo_cache.remember(pending)
+    table_versions.bump('customer')
     cursor.close()
     db.close()
 
@@ -440,34 +888,106 @@ def updateCustomer():
 # As a user I want to be able to delete a customer if they no longer wish to patron at store
 @app.route("/deleteCustomer", methods=['POST'])
 def deleteCustomer():
-    db = get_db()
-    cursor = db.cursor()
-
     # Getting data
     data = request.get_json()
     customer_id = data['customer_id']
 
-    sql_delete_payments = "DELETE FROM sakila.payment WHERE customer_id = %s;"
-    sql_delete_rentals = "DELETE FROM sakila.rental WHERE customer_id = %s;"
-    sql_delete_customer = "DELETE FROM sakila.customer WHERE customer_id = %s;"
-
-    cursor.execute(sql_delete_payments, (customer_id,))
-    cursor.execute(sql_delete_rentals, (customer_id,))
-    cursor.execute(sql_delete_customer, (customer_id,))
-
-    db.commit()
-    rows_deleted = cursor.rowcount
+    db = get_db()
+    cursor = db.cursor()
+    queries.CUSTOMER_EXISTS.run(cursor, customer_id)
+    exists = cursor.fetchone() is not None
     cursor.close()
     db.close()
 
-    if rows_deleted > 0:
-        return jsonify({"message": "Customer deleted successfully"})
-    else:
-        return jsonify({"message": "Customer could not be deleted or does not exist"})
+    if not exists:
+        return jsonify({"message": "Customer could not be deleted or does not exist"}), 404
+
+    # The history can be large, so it is removed in chunks by a background job
+    job_id = job_queue.submit('delete_customer', {'customer_id': int(customer_id)})
+    return jsonify({"message": "Customer deletion queued", "job_id": job_id,
+                    "status_url": "/jobs/%d" % job_id}), 202
+
+@job_queue.handler('delete_customer')
+def delete_customer_job(job, payload):
+    # Payments, then rentals, then the customer, each chunk in its own short
+    # transaction so rentals by everyone else aren't blocked behind one huge
+    # delete. Safe to re-run after a crash: every step only deletes what's left.
+    customer_id = payload['customer_id']
+    chunk = app.config['DELETE_CHUNK_SIZE']
+    pause = app.config['DELETE_CHUNK_PAUSE']
+    counts = {'payments': 0, 'rentals': 0}
+
+    db = db_pool.acquire()
+    cursor = db.cursor()
+    try:
+        # A payment or rental made while the job runs blocks the final delete,
+        # so both are swept again before each retry
+        for attempt in range(app.config['DELETE_RETRIES'] + 1):
+            if attempt:
+                time.sleep(app.config['DELETE_RETRY_PAUSE'])
+
+            while True:
+                queries.DELETE_PAYMENTS_CHUNK.run(cursor, customer_id, chunk)
+                deleted = cursor.rowcount
+                db.commit()
+                counts['payments'] += deleted
+                job.progress(**counts)
+                if deleted < chunk:
+                    break
+                time.sleep(pause)
+
+            while True:
+                queries.CUSTOMER_RENTALS_CHUNK.run(cursor, customer_id, chunk)
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                rental_ids = [row['rental_id'] for row in rows]
+                stats.forget_rentals(cursor, rental_ids)
+                queries.DELETE_RENTALS_BY_ID.run(cursor, rental_ids)
+                db.commit()
+                # Copies the customer still held go back on the shelf
+                for row in rows:
+                    if row['open']:
+                        availability.release(row['inventory_id'])
+                counts['rentals'] += len(rows)
+                job.progress(**counts)
+                time.sleep(pause)
+
+            stats.forget_customer(cursor, customer_id)
+            try:
+                queries.DELETE_CUSTOMER.run(cursor, customer_id)
+            except pymysql.err.IntegrityError as e:
+                db.rollback()
+                if e.args[0] != ROW_IS_REFERENCED:
+                    raise
+                continue
+            deleted = cursor.rowcount
+            db.commit()
+            break
+        else:
+            raise RuntimeError("customer %s is still referenced after %d attempts"
+                               % (customer_id, app.config['DELETE_RETRIES'] + 1))
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+        db.close()
+        table_versions.bump('rental', 'customer')
+
+    return dict(counts, customer_deleted=deleted > 0)
+
+@app.route("/jobs/<int:job_id>", methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(job)
 
 # Customers Page Feature 6
 # As a user I want to be able to view details of the film
 @app.route("/details/customerdata", methods=['POST'])
+@replica_read
 def customersData():
     db = get_db()
     cursor = db.cursor()
@@ -475,37 +995,88 @@ def customersData():
     # Getting data film_id
     data = request.get_json()
     customer_id = data['customer_id']
-    sql_query = """SELECT 
-    c.customer_id, 
-    c.first_name, 
-    c.last_name, 
-    c.email, 
-    a.address, 
-    a.address2,
-    a.district, 
-    a.postal_code, 
-    a.phone, 
-    ci.city, 
-    co.country, 
-    c.create_date,
-    c.last_update,
-    SUM(CASE WHEN r.return_date IS NOT NULL THEN 1 ELSE 0 END) AS rented,
-    SUM(CASE WHEN r.return_date IS NULL AND r.rental_date IS NOT NULL THEN 1 ELSE 0 END) AS renting
-FROM sakila.customer c
-JOIN sakila.address a ON c.address_id = a.address_id
-JOIN sakila.city ci ON a.city_id = ci.city_id
-JOIN sakila.country co ON ci.country_id = co.country_id
-LEFT JOIN sakila.rental r ON c.customer_id = r.customer_id
-LEFT JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
-LEFT JOIN sakila.film f ON i.film_id = f.film_id
-WHERE c.customer_id = %s;
-"""
-    cursor.execute(sql_query, customer_id)
+    queries.CUSTOMER_DATA.run(cursor, customer_id)
     results = cursor.fetchall()
     cursor.close()
     db.close()
     return jsonify(results)
 
+# Customers Page: rental history
+# As a user I want to see which films a customer rented and which they still hold.
+# Newest first, keyset paged on (rental_date, rental_id). Filters: status=open|returned,
+# from (inclusive) and to (exclusive) as ISO dates. stream=1 sends every
+# matching row as NDJSON instead of a page.
+RENTAL_HISTORY_COLUMNS = ['rental_id', 'rental_date', 'return_date', 'inventory_id', 'film_id', 'title']
+
+@app.route("/customers/<int:customer_id>/rentals", methods=['GET'])
+@route_class('heavy')
+@replica_read
+def customer_rentals(customer_id):
+    where = ["r.customer_id = %s"]
+    params = [customer_id]
+    status = request.args.get('status')
+    if status == 'open':
+        where.append("r.return_date IS NULL")
+    elif status == 'returned':
+        where.append("r.return_date IS NOT NULL")
+    elif status:
+        return jsonify({'message': 'status must be open or returned'}), 400
+    try:
+        for arg, op in (('from', '>='), ('to', '<')):
+            if request.args.get(arg):
+                where.append("r.rental_date %s %%s" % op)
+                params.append(datetime.fromisoformat(request.args[arg]))
+    except ValueError:
+        return jsonify({'message': 'from and to must be ISO dates'}), 400
+
+    try:
+        after = decode_cursor(request.args.get('cursor'), 2)
+        if after:
+            after = [datetime.fromisoformat(after[0]), int(after[1])]
+    except (ValueError, TypeError):
+        return jsonify({'message': 'Invalid cursor'}), 400
+    if after:
+        where.append("(r.rental_date < %s OR (r.rental_date = %s AND r.rental_id < %s))")
+        params.extend([after[0], after[0], after[1]])
+
+    # Walks idx_rental_customer_date backwards from the cursor; status is
+    # checked from the index too, so only the page's rows are looked up
+    sql_query = """SELECT r.rental_id, r.rental_date, r.return_date, r.inventory_id, i.film_id, f.title
+                    FROM sakila.rental r
+                    JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
+                    JOIN sakila.film f ON i.film_id = f.film_id
+                    WHERE %s
+                    ORDER BY r.rental_date DESC, r.rental_id DESC""" % " AND ".join(where)
+
+    if request.args.get('stream') in ('1', 'true'):
+        return Response(stream_ndjson(sql_query, params, read_pool()), mimetype='application/x-ndjson')
+
+    limit = page_limit()
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(sql_query + " LIMIT %s", params + [limit + 1])
+    results = cursor.fetchall()
+    cursor.close()
+    db.close()
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor([results[-1]['rental_date'].isoformat(), results[-1]['rental_id']])
+    return list_response('rentals', results, RENTAL_HISTORY_COLUMNS, next_cursor=next_cursor)
+
+def stream_ndjson(sql_query, params, pool=db_pool):
+    # One JSON document per line, read through an unbuffered cursor
+    db = pool.acquire()
+    cursor = db.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        cursor.execute(sql_query, params)
+        for row in cursor:
+            yield app.json.dumps(row) + '\n'
+    finally:
+        cursor.close()
+        db.close()
+
 # Customers Page Feature 7
 # As a user I want to be able to indicate that a customer has returned a rented movie
 @app.route("/returnFilm", methods=['POST'])
@@ -516,38 +1087,422 @@ def returnFilm():
     # Getting data
     data = request.get_json()
     customer_id = data['customer_id']
-    film_id = data['film_id']
 
-    sql_query = """UPDATE sakila.rental 
-    SET return_date = NOW()
-    WHERE rental_id = (
-        SELECT rental_id FROM (
-            SELECT r.rental_id
-            FROM sakila.rental r
-            JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
-            WHERE r.customer_id = %s
-            AND i.film_id = %s
-            AND r.return_date IS NULL
-            ORDER BY r.rental_date ASC
-            LIMIT 1
-        ) AS subquery
-    );
-    """
-
-    cursor.execute(sql_query, (customer_id, film_id))
+    # A rental_id from the rental history names the rental exactly; with only a
+    # film_id the customer's oldest open rental of that film is returned
+    if data.get('rental_id') is not None:
+        queries.OPEN_RENTAL_BY_ID.run(cursor, data['rental_id'], customer_id)
+    else:
+        queries.OLDEST_OPEN_RENTAL.run(cursor, customer_id, data['film_id'])
+    rental = cursor.fetchone()
+
+    returned = False
+    if rental:
+        queries.RETURN_RENTAL.run(cursor, rental['rental_id'])
+        returned = cursor.rowcount > 0
+        if returned:
+            stats.record_returns(cursor, [customer_id])
     db.commit()
     cursor.close()
     db.close()
 
-    if cursor.rowcount > 0:
-        return jsonify({"message": "Film returned"})
+    if returned:
+        table_versions.bump('rental')
+        availability.release(rental['inventory_id'], rental['film_id'])
+        return jsonify({"message": "Film returned", "rental_id": rental['rental_id']})
     else:
         return jsonify({"message": "Film could not be returned"})
 
-    
 
+# Bulk write endpoints
+# Accept a JSON array or an NDJSON stream (Content-Type: application/x-ndjson),
+# write in chunks with one transaction per chunk and report a status per item
+def bulk_items():
+    if request.mimetype == 'application/x-ndjson':
+        for line in request.stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            raise ValueError("Expected a JSON array")
+        yield from data
+
+def bulk_chunks():
+    size = app.config['BULK_CHUNK_SIZE']
+    chunk = []
+    for item in bulk_items():
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def bulk_response(results, message=None, status=200):
+    # results only lists committed chunks, so a failed request still says
+    # which items were written; the rest were not
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    body = {'results': results, 'summary': summary}
+    if message:
+        body['message'] = message
+    return jsonify(body), status
+
+def bulk_failed(results):
+    app.logger.exception("bulk request stopped after %d items", len(results))
+    return bulk_response(results, 'Stopped after %d items, the rest were not written' % len(results), 500)
+
+def item_ids(item, *keys):
+    # The item's ids as ints, None unless it is an object with all of them
+    if not isinstance(item, dict):
+        return None
+    try:
+        return tuple(int(item[key]) for key in keys)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+CUSTOMER_REQUIRED = ['first_name', 'last_name', 'email', 'phone', 'address', 'district', 'city', 'country',
+                     'postal_code']
+
+@app.route("/customer/add/bulk", methods=['POST'])
+@route_class('bulk')
+def add_customers_bulk():
+    db = get_db()
+    cursor = db.cursor()
+    results = []
+    seen_emails = set()
+
+    try:
+        for chunk in bulk_chunks():
+            base = len(results)
+            statuses = []
+            for item in chunk:
+                if not isinstance(item, dict) or any(not item.get(f) for f in CUSTOMER_REQUIRED):
+                    statuses.append('field empty')
+                elif item['email'] in seen_emails:
+                    statuses.append('duplicate email')
+                else:
+                    seen_emails.add(item['email'])
+                    statuses.append(None)
+
+            todo = [i for i, status in enumerate(statuses) if status is None]
+            if todo:
+                queries.EXISTING_EMAILS.run(cursor, [chunk[i]['email'] for i in todo])
+                existing = {row['email'] for row in cursor.fetchall()}
+                for i in todo:
+                    if chunk[i]['email'] in existing:
+                        statuses[i] = 'duplicate email'
+                todo = [i for i in todo if statuses[i] is None]
+
+            pending = []
+            if todo:
+                # Resolve cities, then find or insert every address of the chunk in three statements
+                keys = {}
+                for i in todo:
+                    city_id, new = geo_cache.resolve(cursor, chunk[i].get('country'), chunk[i]['city'])
+                    pending.extend(new)
+                    keys[i] = (chunk[i]['address'], city_id)
+
+                address_ids = find_or_insert_addresses(cursor, [(keys[i], chunk[i]) for i in todo])
+                queries.INSERT_CUSTOMER.run_many(cursor, [
+                    (1, chunk[i]['first_name'], chunk[i]['last_name'], chunk[i]['email'], address_ids[keys[i]], 1)
+                    for i in todo])
+                for i in todo:
+                    statuses[i] = 'added'
+            db.commit()
+            geo_cache.remember(pending)
+            if todo:
+                table_versions.bump('customer')
+
+            for i, status in enumerate(statuses):
+                results.append({'index': base + i, 'status': status})
+    except ValueError as e:
+        db.rollback()
+        return bulk_response(results, str(e), 400)
+    except Exception:
+        db.rollback()
+        return bulk_failed(results)
+
+    cursor.close()
+    db.close()
+    return bulk_response(results)
+
+def find_or_insert_addresses(cursor, entries):
+    # entries: [((address, city_id), item)], returns {(address, city_id): address_id}
+    wanted = {}
+    for key, item in entries:
+        wanted.setdefault(key, item)
+
+    def lookup(keys):
+        cursor.execute("SELECT address_id, address, city_id FROM address WHERE (address, city_id) IN (%s)"
+                       % ", ".join(["(%s, %s)"] * len(keys)), [v for key in keys for v in key])
+        return {(row['address'], row['city_id']): row['address_id'] for row in cursor.fetchall()}
+
+    found = lookup(list(wanted))
+    missing = [key for key in wanted if key not in found]
+    if missing:
+        queries.INSERT_ADDRESSES.run_many(cursor, [
+            (key[0], wanted[key].get('address2'), wanted[key]['district'], key[1],
+             wanted[key]['postal_code'], wanted[key]['phone']) for key in missing])
+        found.update(lookup(missing))
+    return found
+
+@app.route("/rentFilm/bulk", methods=['POST'])
+@route_class('bulk')
+def rentFilm_bulk():
+    db = get_db()
+    cursor = db.cursor()
+    results = []
+    rented_any = False
+
+    try:
+        for chunk in bulk_chunks():
+            base = len(results)
+            statuses = ['invalid'] * len(chunk)
+            wanted = {i: item_ids(item, 'customer_id', 'film_id') for i, item in enumerate(chunk)}
+            wanted = {i: pair for i, pair in wanted.items() if pair is not None}
+
+            # An unknown customer would fail the whole chunk on the foreign key
+            if wanted:
+                queries.KNOWN_CUSTOMERS.run(cursor, list({customer_id for customer_id, _ in wanted.values()}))
+                known = {row['customer_id'] for row in cursor.fetchall()}
+                # allocate_many() has to start with no transaction open
+                db.commit()
+                wanted = {i: pair for i, pair in wanted.items() if pair[0] in known}
+
+            rented = rentals.allocate_many(db, list(wanted.values()))
+            for i, inventory_id in zip(wanted, rented):
+                if inventory_id is None:
+                    statuses[i] = 'no stock'
+                else:
+                    statuses[i] = 'rented'
+                    rented_any = True
+                    availability.mark_rented(inventory_id)
+            for i, status in enumerate(statuses):
+                results.append({'index': base + i, 'status': status})
+    except ValueError as e:
+        return bulk_response(results, str(e), 400)
+    except Exception:
+        return bulk_failed(results)
+    finally:
+        if rented_any:
+            table_versions.bump('rental')
+
+    cursor.close()
+    db.close()
+    return bulk_response(results)
+
+@app.route("/returnFilm/bulk", methods=['POST'])
+@route_class('bulk')
+def returnFilm_bulk():
+    db = get_db()
+    cursor = db.cursor()
+    results = []
+    returned_any = False
+
+    try:
+        for chunk in bulk_chunks():
+            base = len(results)
+            statuses = ['invalid'] * len(chunk)
+            wanted = {i: item_ids(item, 'customer_id', 'film_id') for i, item in enumerate(chunk)}
+            wanted = {i: pair for i, pair in wanted.items() if pair is not None}
+
+            # Open rentals of every customer in the chunk, oldest first
+            open_rentals = {}
+            if wanted:
+                queries.OPEN_RENTALS_FOR_CUSTOMERS.run(cursor, list({customer_id for customer_id, _ in wanted.values()}))
+                for row in cursor.fetchall():
+                    open_rentals.setdefault((row['customer_id'], row['film_id']), []).append(row)
+
+            returning = {}
+            for i, pair in wanted.items():
+                rentals = open_rentals.get(pair)
+                if rentals:
+                    returning[i] = rentals.pop(0)
+                else:
+                    statuses[i] = 'not rented'
+
+            if returning:
+                queries.RETURN_RENTALS.run(cursor, [rental['rental_id'] for rental in returning.values()])
+                stats.record_returns(cursor, [rental['customer_id'] for rental in returning.values()])
+            db.commit()
+
+            for i, rental in returning.items():
+                statuses[i] = 'returned'
+                availability.release(rental['inventory_id'], rental['film_id'])
+                returned_any = True
+            for i, status in enumerate(statuses):
+                results.append({'index': base + i, 'status': status})
+    except ValueError as e:
+        db.rollback()
+        return bulk_response(results, str(e), 400)
+    except Exception:
+        db.rollback()
+        return bulk_failed(results)
+    finally:
+        if returned_any:
+            table_versions.bump('rental')
+
+    cursor.close()
+    db.close()
+    return bulk_response(results)
+
+
+# Batch variants of the detail endpoints
+# Each takes a list of ids and resolves them with one query, grouped by id
+def batch_ids(key):
+    # The distinct ids under key, ValueError with the reason when the body isn't usable
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    ids = data.get(key)
+    if not isinstance(ids, list) or not ids:
+        raise ValueError("%s must be a non-empty list" % key)
+    try:
+        ids = list(dict.fromkeys(int(i) for i in ids))
+    except (TypeError, ValueError):
+        raise ValueError("%s must be integers" % key)
+    if len(ids) > app.config['MAX_BATCH_SIZE']:
+        raise ValueError("At most %d %s per request" % (app.config['MAX_BATCH_SIZE'], key))
+    return ids
+
+def group_rows(rows, key, ids):
+    grouped = {i: [] for i in ids}
+    for row in rows:
+        grouped.setdefault(row[key], []).append(row)
+    return grouped
+
+@app.route("/details/top5films/batch", methods=['POST'])
+@route_class('heavy')
+@replica_read
+def film_details_batch():
+    try:
+        film_ids = batch_ids('film_ids')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    db = get_db()
+    cursor = db.cursor()
+    queries.FILM_DETAILS_BATCH.run(cursor, film_ids)
+    results = cursor.fetchall()
+    cursor.close()
+    db.close()
+    return jsonify(group_rows(results, 'film_id', film_ids))
+
+@app.route("/details/filmdata/batch", methods=['POST'])
+@route_class('heavy')
+@replica_read
+def filmsData_batch():
+    try:
+        film_ids = batch_ids('film_ids')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
 
+    db = get_db()
+    cursor = db.cursor()
+    queries.FILM_DATA_BATCH.run(cursor, film_ids)
+    results = cursor.fetchall()
+    cursor.close()
+    db.close()
+    return jsonify(group_rows(results, 'film_id', film_ids))
+
+@app.route("/details/top5actors/batch", methods=['POST'])
+@route_class('heavy')
+@replica_read
+def actor_details_batch():
+    try:
+        actor_ids = batch_ids('actor_ids')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    db = get_db()
+    cursor = db.cursor()
+    queries.ACTOR_DETAILS_BATCH.run(cursor, actor_ids, actor_ids)
+    results = cursor.fetchall()
+    cursor.close()
+    db.close()
+    return jsonify(group_rows(results, 'actor_id', actor_ids))
+
+@app.route("/details/customerdata/batch", methods=['POST'])
+@route_class('heavy')
+@replica_read
+def customersData_batch():
+    try:
+        customer_ids = batch_ids('customer_ids')
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    db = get_db()
+    cursor = db.cursor()
+    queries.CUSTOMER_DATA_BATCH.run(cursor, customer_ids)
+    results = cursor.fetchall()
+    cursor.close()
+    db.close()
+    return jsonify(group_rows(results, 'customer_id', customer_ids))
+
+
+# Management command: flask --app server rebuild-stats
+@app.cli.command('rebuild-stats')
+def rebuild_stats():
+    """Recompute the rental summary tables from sakila.rental."""
+    db = db_pool.acquire()
+    try:
+        stats.rebuild(db)
+    finally:
+        db.close()
+    table_versions.bump('rental')
+    print("Rental statistics rebuilt")
+
+
+def check_queries():
+    db = db_pool.acquire()
+    try:
+        problems = queries.check_plans(db, max_rows=app.config['QUERY_PLAN_MAX_ROWS'])
+    finally:
+        db.close()
+    for name, warnings in problems.items():
+        for warning in warnings:
+            app.logger.warning("query %s: %s", name, warning)
+    return problems
+
+# Management command: flask --app server migrate [--check]
+@app.cli.command('migrate')
+@click.option('--check', is_flag=True, help='Only verify the indexes, apply nothing.')
+def migrate_command(check):
+    """Apply pending migrations and check that the catalog queries use their indexes."""
+    db = db_pool.acquire()
+    try:
+        if not check:
+            for version in migrate.migrate(db):
+                print("Applied %s" % version)
+        results = migrate.verify(db)
+    finally:
+        db.close()
+    missing = 0
+    for version, name, index, used in results:
+        print("%-32s %-28s %-30s %s" % (version, name, index, 'ok' if used else 'NOT USED'))
+        missing += not used
+    if missing:
+        raise SystemExit(1)
+
+# Management command: flask --app server check-queries
+@app.cli.command('check-queries')
+def check_queries_command():
+    """EXPLAIN every catalog query and fail on full table scans."""
+    problems = check_queries()
+    print("%d queries checked, %d with warnings" % (len(queries.CATALOG), len(problems)))
+    if problems:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
+    availability.ensure_loaded()
+    geo_cache.ensure_loaded()
+    film_search.ensure_loaded()
+    job_queue.ensure_started()
+    if app.config['QUERY_SELF_CHECK']:
+        check_queries()
     app.run(debug=True, port=8080)
\ No newline at end of file
@@ -0,0 +1,114 @@
+# Summary tables behind the leaderboards and the customer details.
+# Migration 0008 creates them and 0009 fills them. They are kept current by the
+# rent/return/delete handlers (returns and deletes in the same transaction as
+# the write, rentals right after theirs commits, see rentals.record) and can be
+# rebuilt from scratch with
+#
+#   flask --app server rebuild-stats
+
+REBUILD = [
+    "DELETE FROM sakila.film_rental_counts",
+    """INSERT INTO sakila.film_rental_counts (film_id, rentals)
+        SELECT i.film_id, COUNT(*)
+        FROM sakila.rental r
+        JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
+        GROUP BY i.film_id""",
+    "DELETE FROM sakila.actor_film_counts",
+    """INSERT INTO sakila.actor_film_counts (actor_id, films)
+        SELECT actor_id, COUNT(film_id)
+        FROM sakila.film_actor
+        GROUP BY actor_id""",
+    "DELETE FROM sakila.actor_film_rental_counts",
+    """INSERT INTO sakila.actor_film_rental_counts (actor_id, film_id, rentals)
+        SELECT fa.actor_id, fa.film_id, frc.rentals
+        FROM sakila.film_actor fa
+        JOIN sakila.film_rental_counts frc ON fa.film_id = frc.film_id""",
+    "DELETE FROM sakila.customer_rental_counts",
+    """INSERT INTO sakila.customer_rental_counts (customer_id, rented, renting)
+        SELECT customer_id,
+            SUM(CASE WHEN return_date IS NOT NULL THEN 1 ELSE 0 END),
+            SUM(CASE WHEN return_date IS NULL THEN 1 ELSE 0 END)
+        FROM sakila.rental
+        GROUP BY customer_id""",
+]
+
+
+def rebuild(db):
+    cursor = db.cursor()
+    try:
+        for statement in REBUILD:
+            cursor.execute(statement)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _counts(keys):
+    # Turns [k, k, j] into a derived table of (k, n) rows: "SELECT %s AS k, %s AS n UNION ALL ..."
+    counts = {}
+    for key in keys:
+        counts[key] = counts.get(key, 0) + 1
+    sql = " UNION ALL ".join(["SELECT %s AS k, %s AS n"] * len(counts))
+    params = [v for item in counts.items() for v in item]
+    return sql, params
+
+
+def record_rentals(cursor, rentals):
+    # rentals: [(customer_id, film_id)] just inserted into sakila.rental
+    if not rentals:
+        return
+    films, params = _counts([int(film_id) for _, film_id in rentals])
+    cursor.execute("""INSERT INTO sakila.film_rental_counts (film_id, rentals)
+        SELECT d.k, d.n FROM (%s) d
+        ON DUPLICATE KEY UPDATE rentals = sakila.film_rental_counts.rentals + d.n""" % films, params)
+    cursor.execute("""INSERT INTO sakila.actor_film_rental_counts (actor_id, film_id, rentals)
+        SELECT fa.actor_id, fa.film_id, d.n FROM (%s) d
+        JOIN sakila.film_actor fa ON fa.film_id = d.k
+        ON DUPLICATE KEY UPDATE rentals = sakila.actor_film_rental_counts.rentals + d.n""" % films, params)
+    customers, params = _counts([int(customer_id) for customer_id, _ in rentals])
+    cursor.execute("""INSERT INTO sakila.customer_rental_counts (customer_id, rented, renting)
+        SELECT d.k, 0, d.n FROM (%s) d
+        ON DUPLICATE KEY UPDATE renting = sakila.customer_rental_counts.renting + d.n""" % customers, params)
+
+
+def record_returns(cursor, customer_ids):
+    # customer_ids: one entry per rental that was just returned
+    if not customer_ids:
+        return
+    customers, params = _counts([int(customer_id) for customer_id in customer_ids])
+    cursor.execute("""UPDATE sakila.customer_rental_counts c
+        JOIN (%s) d ON c.customer_id = d.k
+        SET c.renting = c.renting - d.n, c.rented = c.rented + d.n""" % customers, params)
+
+
+def forget_rentals(cursor, rental_ids):
+    # Must run before these rentals are deleted, inside the same transaction
+    if not rental_ids:
+        return
+    rental_ids = [int(rental_id) for rental_id in rental_ids]
+    film_counts = """SELECT i.film_id, COUNT(*) AS n
+        FROM sakila.rental r
+        JOIN sakila.inventory i ON r.inventory_id = i.inventory_id
+        WHERE r.rental_id IN %s
+        GROUP BY i.film_id"""
+    cursor.execute("""UPDATE sakila.film_rental_counts frc
+        JOIN (%s) d ON frc.film_id = d.film_id
+        SET frc.rentals = frc.rentals - d.n""" % film_counts, (rental_ids,))
+    cursor.execute("""UPDATE sakila.actor_film_rental_counts afrc
+        JOIN (%s) d ON afrc.film_id = d.film_id
+        SET afrc.rentals = afrc.rentals - d.n""" % film_counts, (rental_ids,))
+    cursor.execute("""UPDATE sakila.customer_rental_counts c
+        JOIN (SELECT customer_id,
+                SUM(CASE WHEN return_date IS NOT NULL THEN 1 ELSE 0 END) AS rented,
+                SUM(CASE WHEN return_date IS NULL THEN 1 ELSE 0 END) AS renting
+            FROM sakila.rental WHERE rental_id IN %s GROUP BY customer_id) d
+        ON c.customer_id = d.customer_id
+        SET c.rented = c.rented - d.rented, c.renting = c.renting - d.renting""", (rental_ids,))
+
+
+def forget_customer(cursor, customer_id):
+    # Once the customer's rentals are gone
+    cursor.execute("DELETE FROM sakila.customer_rental_counts WHERE customer_id = %s", (customer_id,))
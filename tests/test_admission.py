@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from admission import ConcurrencyGate, Overloaded, RateLimiter, retry_after
+
+
+def test_burst_then_wait(clock):
+    limiter = RateLimiter({'cheap': (2, 3)})
+    assert [limiter.take('c', 'cheap') for _ in range(3)] == [0, 0, 0]
+    assert limiter.take('c', 'cheap') == pytest.approx(0.5)
+    clock.advance(0.5)
+    assert limiter.take('c', 'cheap') == 0
+
+
+def test_refill_capped_at_burst(clock):
+    limiter = RateLimiter({'cheap': (10, 2)})
+    limiter.take('c', 'cheap')
+    clock.advance(60)
+    assert limiter.take('c', 'cheap') == 0
+    assert limiter.take('c', 'cheap') == 0
+    assert limiter.take('c', 'cheap') > 0
+
+
+def test_clients_and_classes_have_own_buckets(clock):
+    limiter = RateLimiter({'cheap': (1, 1), 'heavy': (1, 1)})
+    assert limiter.take('a', 'cheap') == 0
+    assert limiter.take('a', 'heavy') == 0
+    assert limiter.take('b', 'cheap') == 0
+    assert limiter.take('a', 'cheap') > 0
+
+
+def test_unlisted_class_not_limited():
+    limiter = RateLimiter({'cheap': (1, 1)})
+    assert all(limiter.take('c', 'monitoring') == 0 for _ in range(100))
+
+
+def test_least_recently_seen_client_dropped(clock):
+    limiter = RateLimiter({'cheap': (1, 1)}, max_clients=2)
+    limiter.take('a', 'cheap')
+    limiter.take('b', 'cheap')
+    limiter.take('a', 'cheap')
+    limiter.take('c', 'cheap')
+    assert list(limiter._buckets) == [('a', 'cheap'), ('c', 'cheap')]
+    # b comes back with a full bucket
+    assert limiter.take('b', 'cheap') == 0
+
+
+def test_gate_turns_away_when_queue_full():
+    gate = ConcurrencyGate(1, queue_size=0, timeout=1)
+    gate.enter()
+    with pytest.raises(Overloaded):
+        gate.enter()
+    gate.exit()
+    gate.enter()
+
+
+def test_gate_waiter_times_out():
+    gate = ConcurrencyGate(1, queue_size=1, timeout=0.05)
+    gate.enter()
+    with pytest.raises(Overloaded):
+        gate.enter()
+    assert gate.stats()['waiting'] == 0
+    assert gate.stats()['active'] == 1
+
+
+def test_gate_waiter_admitted_on_exit():
+    gate = ConcurrencyGate(1, queue_size=1, timeout=5)
+    gate.enter()
+    entered = threading.Event()
+
+    def wait():
+        gate.enter()
+        entered.set()
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(0.05)
+    assert gate.stats()['waiting'] == 1
+    gate.exit()
+    assert entered.wait(2)
+    assert gate.stats() == {'limit': 1, 'active': 1, 'waiting': 0, 'queue_size': 1}
+
+
+def test_gate_never_exceeds_limit():
+    gate = ConcurrencyGate(2, queue_size=16, timeout=5)
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def work():
+        for _ in range(10):
+            gate.enter()
+            with lock:
+                active[0] += 1
+                active[1] = max(active[1], active[0])
+            time.sleep(0.001)
+            with lock:
+                active[0] -= 1
+            gate.exit()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert active[1] <= 2
+    assert gate.stats()['active'] == 0
+
+
+def test_retry_after_whole_seconds():
+    assert retry_after(0.01) == '1'
+    assert retry_after(1.2) == '2'
+    assert retry_after(3) == '3'
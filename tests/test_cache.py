@@ -0,0 +1,103 @@
+import threading
+
+from cache import TTLCache
+
+
+def test_hit_until_ttl_expires(clock):
+    cache = TTLCache(ttl=10, max_size=4)
+    loads = []
+    load = lambda: loads.append(1) or len(loads)
+    assert cache.get_or_load('k', load) == 1
+    clock.advance(9)
+    assert cache.get_or_load('k', load) == 1
+    clock.advance(2)
+    assert cache.get_or_load('k', load) == 2
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_least_recently_used_evicted_first():
+    cache = TTLCache(ttl=60, max_size=2)
+    cache.get_or_load('a', lambda: 'a')
+    cache.get_or_load('b', lambda: 'b')
+    cache.get_or_load('a', lambda: 'stale')
+    cache.get_or_load('c', lambda: 'c')
+    assert list(cache._data) == ['a', 'c']
+    assert cache.stats()['evictions'] == 1
+
+
+def test_concurrent_misses_load_once():
+    cache = TTLCache(ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return 'value'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_load('k', load)))
+    leader.start()
+    started.wait(2)
+    followers = [threading.Thread(target=lambda: results.append(cache.get_or_load('k', load)))
+                 for _ in range(5)]
+    for t in followers:
+        t.start()
+    release.set()
+    for t in [leader] + followers:
+        t.join(2)
+    assert calls == [1]
+    assert results == ['value'] * 6
+
+
+def test_load_error_reaches_waiters_and_is_not_cached():
+    cache = TTLCache(ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(2)
+        raise ValueError("boom")
+
+    errors = []
+
+    def get():
+        try:
+            cache.get_or_load('k', fail)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=get)
+    leader.start()
+    started.wait(2)
+    follower = threading.Thread(target=get)
+    follower.start()
+    release.set()
+    leader.join(2)
+    follower.join(2)
+    assert len(errors) == 2
+    assert cache.get_or_load('k', lambda: 'ok') == 'ok'
+
+
+def test_result_loaded_across_invalidate_is_not_stored():
+    cache = TTLCache(ttl=60)
+
+    def load():
+        cache.invalidate()
+        return 'old'
+
+    assert cache.get_or_load('k', load) == 'old'
+    assert cache.get_or_load('k', lambda: 'new') == 'new'
+
+
+def test_invalidate_one_key():
+    cache = TTLCache(ttl=60)
+    cache.get_or_load('a', lambda: 1)
+    cache.get_or_load('b', lambda: 2)
+    cache.invalidate('a')
+    assert cache.get_or_load('a', lambda: 3) == 3
+    assert cache.get_or_load('b', lambda: 4) == 2
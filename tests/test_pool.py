@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+
+from pool import RATE_WINDOW, ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, fail_rollback=False):
+        self.closed = False
+        self.rollbacks = 0
+        self.pings = 0
+        self.fail_rollback = fail_rollback
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.fail_rollback:
+            raise OSError("connection lost")
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+
+    def close(self):
+        self.closed = True
+
+
+class Connector:
+    def __init__(self):
+        self.made = []
+
+    def __call__(self):
+        conn = FakeConnection()
+        self.made.append(conn)
+        return conn
+
+
+def make_pool(**kwargs):
+    connect = Connector()
+    options = dict(max_size=2, max_lifetime=1800, idle_timeout=300, acquire_timeout=1, ping_interval=5)
+    options.update(kwargs)
+    return ConnectionPool(connect, **options), connect
+
+
+def test_released_connection_is_reused():
+    pool, connect = make_pool()
+    conn = pool.acquire()
+    conn.close()
+    again = pool.acquire()
+    assert again is conn
+    assert len(connect.made) == 1
+    assert connect.made[0].rollbacks == 1
+
+
+def test_close_twice_releases_once():
+    pool, _ = make_pool()
+    conn = pool.acquire()
+    conn.close()
+    conn.close()
+    assert pool.stats()['in_use'] == 0
+    assert pool.stats()['idle'] == 1
+
+
+def test_acquire_times_out_when_exhausted():
+    pool, _ = make_pool(max_size=1, acquire_timeout=0.05)
+    pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['in_use'] == 1
+
+
+def test_waiter_gets_released_connection():
+    pool, connect = make_pool(max_size=1, acquire_timeout=5)
+    held = pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    assert not got
+    held.close()
+    waiter.join(2)
+    assert got == [held]
+    assert len(connect.made) == 1
+
+
+def test_never_more_than_max_size_in_use():
+    pool, connect = make_pool(max_size=3, acquire_timeout=5)
+    lock = threading.Lock()
+    peak = [0, 0]
+
+    def work():
+        for _ in range(20):
+            conn = pool.acquire()
+            with lock:
+                peak[0] += 1
+                peak[1] = max(peak[1], peak[0])
+            time.sleep(0.001)
+            with lock:
+                peak[0] -= 1
+            conn.close()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[1] <= 3
+    assert len(connect.made) <= 3
+    assert pool.stats()['in_use'] == 0
+
+
+def test_idle_connection_evicted_after_idle_timeout(clock):
+    pool, connect = make_pool(idle_timeout=10)
+    conn = pool.acquire()
+    conn.close()
+    clock.advance(11)
+    fresh = pool.acquire()
+    assert fresh is not conn
+    assert connect.made[0].closed
+    assert len(connect.made) == 2
+
+
+def test_expired_connection_discarded_on_release(clock):
+    pool, connect = make_pool(max_lifetime=60)
+    conn = pool.acquire()
+    clock.advance(61)
+    conn.close()
+    assert connect.made[0].closed
+    assert pool.stats()['idle'] == 0
+
+
+def test_failed_rollback_discards_connection():
+    pool, _ = make_pool()
+    raw = FakeConnection(fail_rollback=True)
+    pool._connect = lambda: raw
+    pool.acquire().close()
+    assert raw.closed
+    assert pool.stats()['idle'] == 0
+    assert pool.stats()['in_use'] == 0
+
+
+def test_idle_connection_pinged_before_reuse(clock):
+    pool, connect = make_pool(ping_interval=5)
+    conn = pool.acquire()
+    conn.close()
+    clock.advance(6)
+    pool.acquire()
+    assert connect.made[0].pings == 1
+
+
+def test_failed_connect_frees_the_slot():
+    pool, _ = make_pool(max_size=1, acquire_timeout=0.05)
+
+    def refuse():
+        raise OSError("refused")
+
+    pool._connect = refuse
+    with pytest.raises(OSError):
+        pool.acquire()
+    assert pool.stats()['in_use'] == 0
+
+
+def test_recent_checkouts_trimmed_on_acquire(clock):
+    pool, _ = make_pool()
+    for _ in range(5):
+        pool.acquire().close()
+    clock.advance(RATE_WINDOW + 1)
+    pool.acquire().close()
+    # Trimmed without anyone calling stats()
+    assert len(pool._recent) == 1
+    assert pool.stats()['checkouts'] == 6
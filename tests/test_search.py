@@ -0,0 +1,151 @@
+import threading
+import time
+from datetime import datetime
+
+import queries
+from search import FilmSearch, _one_edit, tokenize
+
+
+class FakeCatalog:
+    # Answers the queries FilmSearch runs from a dict of film rows
+    def __init__(self, films):
+        self.films = dict(films)
+        self.changed = []
+        self.full_loads = 0
+        self.now = datetime(2030, 1, 1)
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def cursor(self):
+        return FakeCursor(self.catalog)
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.rows = []
+
+    def execute(self, sql, args=()):
+        films = self.catalog.films
+        if sql == queries.DB_NOW.sql:
+            self.rows = [{'now': self.catalog.now}]
+        elif sql == queries.SEARCH_DOCUMENTS.sql:
+            self.catalog.full_loads += 1
+            time.sleep(0.01)
+            self.rows = [dict(row, film_id=film_id) for film_id, row in films.items()]
+        elif sql == queries.SEARCH_DOCUMENTS_FOR.sql:
+            self.rows = [dict(films[film_id], film_id=film_id) for film_id in args[0] if film_id in films]
+        elif sql == queries.CHANGED_FILMS.sql:
+            self.rows = [{'film_id': film_id} for film_id in self.catalog.changed]
+        else:
+            raise AssertionError(sql)
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+def film(title, description='', actors=None, categories=None):
+    return {'title': title, 'description': description, 'actors': actors, 'categories': categories}
+
+
+FILMS = {
+    1: film('ACADEMY DINOSAUR', 'An Epic Drama of a Feminist', 'PENELOPE GUINESS|CHRISTIAN GABLE', 'Documentary'),
+    2: film('ACE GOLDFINGER', 'A Astounding Epistle of a Database Administrator', 'BOB FAWCETT', 'Horror'),
+    3: film('ADAPTATION HOLES', 'A Astounding Reflection of a Lumberjack', 'NICK WAHLBERG', 'Documentary'),
+    4: film('DINOSAUR SECRETARY', 'A Action-Packed Drama', 'PENELOPE GUINESS', 'Action'),
+}
+
+
+def make_index(films=FILMS):
+    catalog = FakeCatalog(films)
+    return FilmSearch(catalog.connect, refresh_interval=0, rebuild_interval=0), catalog
+
+
+def ids(hits):
+    return [film_id for film_id, _ in hits]
+
+
+def test_tokenize_and_one_edit():
+    assert tokenize("Ace-Goldfinger's 2") == ['ace', 'goldfinger', 's', '2']
+    assert tokenize(None) == []
+    assert _one_edit('dinosaur', 'dinosuar')
+    assert _one_edit('dinosaur', 'dinosau')
+    assert _one_edit('dinosaur', 'dinosaurs')
+    assert not _one_edit('dinosaur', 'dinosaur')
+    assert not _one_edit('dinosaur', 'dinosr')
+
+
+def test_title_match_outranks_description():
+    index, _ = make_index()
+    hits, has_more = index.search('dinosaur')
+    assert ids(hits) == [1, 4]
+    assert not has_more
+
+
+def test_every_word_must_match():
+    index, _ = make_index()
+    assert sorted(ids(index.search('penelope drama')[0])) == [1, 4]
+    assert ids(index.search('penelope lumberjack')[0]) == []
+
+
+def test_prefix_and_typo_matches():
+    index, _ = make_index()
+    assert ids(index.search('gold')[0]) == [2]
+    assert ids(index.search('lumberjakc')[0]) == [3]
+
+
+def test_fields_restrict_the_match():
+    index, _ = make_index()
+    assert ids(index.search('documentary', fields=('title',))[0]) == []
+    assert sorted(ids(index.search('documentary', fields=('categories',))[0])) == [1, 3]
+
+
+def test_pages_continue_after_last_hit():
+    index, _ = make_index()
+    first, has_more = index.search('a', limit=2)
+    assert has_more
+    last_id, last_score = first[-1]
+    rest, _ = index.search('a', after=(last_score, last_id), limit=10)
+    assert not set(ids(first)) & set(ids(rest))
+    assert len(first) + len(rest) == len(index.search('a', limit=10)[0])
+
+
+def test_refresh_reindexes_changed_films_and_bumps_version():
+    index, catalog = make_index()
+    token, _ = index.version()
+    assert index.refresh() == 0
+    assert index.version()[0] == token
+
+    catalog.films[2] = film('ACE SILVERFINGER')
+    catalog.changed = [2, 3]
+    del catalog.films[3]
+    assert index.refresh() == 2
+    assert ids(index.search('goldfinger')[0]) == []
+    assert ids(index.search('silverfinger')[0]) == [2]
+    assert ids(index.search('lumberjack')[0]) == []
+    assert index.version()[0] != token
+
+
+def test_concurrent_cold_searches_load_once():
+    index, catalog = make_index()
+    threads = [threading.Thread(target=index.search, args=('dinosaur',)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert catalog.full_loads == 1